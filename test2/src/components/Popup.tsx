@@ -41,7 +41,10 @@ const Popup = ({ open, handleClose, filtredImage }: PopupProps) => {
       "-" +
       date.getSeconds().toString().padStart(2, "0");
 
-    link.download = `enhanced_${dateString}.png`;
+    // The backend may answer with JPEG or WebP for large photos
+    const mimeType = image.substring(image.indexOf(":") + 1, image.indexOf(";"));
+    const extension = mimeType === "image/jpeg" ? "jpg" : mimeType.split("/")[1];
+    link.download = `enhanced_${dateString}.${extension || "png"}`;
     document.body.appendChild(link);
     link.click();
     document.body.removeChild(link);
@@ -32,27 +32,80 @@ const index = () => {
   };
   // End Dialog Popup Control
 
+  // Swap the preview for the full-resolution result once its job is done
+  const fetchFullResolution = (jobUrl: string) => {
+    fetch(`http://127.0.0.1:5000${jobUrl}`)
+      .then((response) => {
+        if (response.status === 202) {
+          setTimeout(() => fetchFullResolution(jobUrl), 1000);
+          return null;
+        }
+        return response.ok ? response.json() : null;
+      })
+      .then((data) => {
+        if (!data) return;
+        setFiltredImageUrl({
+          approach1: data.approach1,
+          approach2: data.approach2,
+        });
+      })
+      .catch((error) => console.error("Full resolution error:", error));
+  };
+
+  // Parse a text/event-stream body, calling onEvent for every complete event
+  const readEvents = async (
+    response: Response,
+    onEvent: (event: string, data: any) => void
+  ) => {
+    if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let end = buffer.indexOf("\n\n");
+      while (end !== -1) {
+        const lines = buffer.slice(0, end).split("\n");
+        buffer = buffer.slice(end + 2);
+        const event = lines.find((line) => line.startsWith("event: "))?.slice(7);
+        const data = lines.find((line) => line.startsWith("data: "))?.slice(6);
+        if (event && data) onEvent(event, JSON.parse(data));
+        end = buffer.indexOf("\n\n");
+      }
+    }
+  };
+
   useEffect(() => {
     const uploadImage = async () => {
       console.log(imageUrl);
       if (!imageUrl) return;
-      fetch("http://127.0.0.1:5000/filter-image", {
+      // Each approach is shown as soon as the server streams it
+      fetch("http://127.0.0.1:5000/filter-image/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ image: imageUrl }),
+        body: JSON.stringify({ image: imageUrl, preview: 1600 }),
       })
-        .then((response) => response.json())
-        .then((data) => {
-          isError(false);
-          console.log("Success:", data);
-          setFiltredImageUrl({
-            approach1: data.approach1,
-            approach2: data.approach2,
-          });
-          setTimeout(() => isGoodRespense(true), 2000);
-        })
+        .then((response) =>
+          readEvents(response, (event, data) => {
+            if (event === "image") {
+              isError(false);
+              setFiltredImageUrl((previous) => ({
+                ...previous,
+                [data.name]: data.image,
+              }));
+              isGoodRespense(true);
+            } else if (event === "job" && data.job?.url) {
+              // No url when the server was too busy to queue the full-resolution job
+              fetchFullResolution(data.job.url);
+            } else if (event === "error") {
+              throw new Error(data.error);
+            }
+          })
+        )
         .catch((error) => {
           console.error("Upload error:", error);
           isError(true);
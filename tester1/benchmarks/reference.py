@@ -0,0 +1,88 @@
+"""
+Frozen copy of the original Approach1/Approach2 pixel pipeline.
+
+This is the arithmetic the enhancement started from: float32 gray-world and float64
+percentile white balance, plain histogram equalization or CLAHE, luminance weight maps applied
+to the LAB lightness channel and the float64 weighted average fusion. Saliency and chromatic
+maps are left out because they never reached the output. Optimized code paths are checked
+against these functions, so do not change them.
+"""
+import cv2
+import numpy as np
+
+
+def _gray(image: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def gray_world(image: np.ndarray) -> np.ndarray:
+    b, g, r = cv2.split(image.astype(np.float32))
+    avg_b, avg_g, avg_r = np.mean(b), np.mean(g), np.mean(r)
+    gray_value = (avg_b + avg_g + avg_r) / 3
+    b = np.clip(b * (gray_value / avg_b), 0, 255).astype(np.uint8)
+    g = np.clip(g * (gray_value / avg_g), 0, 255).astype(np.uint8)
+    r = np.clip(r * (gray_value / avg_r), 0, 255).astype(np.uint8)
+    return cv2.merge([b, g, r])
+
+
+def percentile_white_balance(image: np.ndarray) -> np.ndarray:
+    double_img = image.astype(np.float64)
+    max_values = np.percentile(double_img, 99, axis=(0, 1))
+    return (double_img / max_values * 255).clip(0, 255).astype(np.uint8)
+
+
+def equalize(image: np.ndarray) -> np.ndarray:
+    return cv2.equalizeHist(_gray(image))
+
+
+def clahe(image: np.ndarray) -> np.ndarray:
+    return cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(_gray(image))
+
+
+def luminance_weight_map(img: np.ndarray) -> np.ndarray:
+    if img.ndim < 3:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2YUV)[:, :, 0] / 255.0
+
+
+def apply_luminance_map(img: np.ndarray, luminance_map: np.ndarray) -> np.ndarray:
+    if img.ndim < 3:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+    luminance_map = cv2.resize(luminance_map, (img.shape[1], img.shape[0]))
+    luminance_map = luminance_map.astype(np.float32) / 255.0
+    l, a, b = cv2.split(img)
+    l = (l * luminance_map + (1 - luminance_map) * l).astype(np.uint8)
+    return cv2.cvtColor(cv2.merge((l, a, b)), cv2.COLOR_LAB2BGR)
+
+
+def fuse(image1, image2, weight_map1, weight_map2) -> np.ndarray:
+    weight_map1 = weight_map1[:, :, np.newaxis]
+    weight_map2 = weight_map2[:, :, np.newaxis]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fused = (image1 * weight_map1 + image2 * weight_map2) / (weight_map1 + weight_map2)
+    return np.clip(fused, 0, 255).astype(np.uint8)
+
+
+def _process(image: np.ndarray, white_balance, enhance_contrast) -> np.ndarray:
+    balanced = white_balance(image)
+    contrast = enhance_contrast(image)
+    luminance1 = luminance_weight_map(contrast)
+    luminance2 = luminance_weight_map(balanced)
+    return fuse(
+        apply_luminance_map(contrast, luminance1),
+        apply_luminance_map(balanced, luminance2),
+        luminance1,
+        luminance2,
+    )
+
+
+def approach1(image: np.ndarray) -> np.ndarray:
+    return _process(image, gray_world, equalize)
+
+
+def approach2(image: np.ndarray) -> np.ndarray:
+    return _process(image, percentile_white_balance, clahe)
+
+
+REFERENCES = {"approach1": approach1, "approach2": approach2}
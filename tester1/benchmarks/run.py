@@ -0,0 +1,342 @@
+"""
+Benchmark the enhancement on synthetic underwater photos.
+
+    python benchmarks/run.py --sizes 0.3 2 --output results.json
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+
+Every method of Approach1 and Approach2, the shared FusionPipeline on each backend and a
+/filter-image round trip through the Flask test client are timed at each size (median of
+--repeat runs). The outputs are also checked against the frozen original pipeline in
+reference.py, and the run fails if any pixel differs by more than --tolerance, or if strips or
+a frame batch differ at all from processing the whole image or its frames one by one. Timings
+are written to JSON and, with --baseline, compared against an earlier run.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+sys.path.insert(0, os.path.normpath(SRC))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+import reference  # noqa: E402
+import synthetic  # noqa: E402
+from approaches.Approach1 import Approach1  # noqa: E402
+from approaches.Approach2 import Approach2  # noqa: E402
+from approaches import backends, blending  # noqa: E402
+from approaches.backends import BACKENDS  # noqa: E402
+from approaches.fusion import (  # noqa: E402
+    APPROACHES,
+    FusionPipeline,
+    with_parameters,
+    with_weight_maps,
+)
+
+SIZES = (0.3, 2, 12, 50)
+APPROACH_CLASSES = {"approach1": Approach1, "approach2": Approach2}
+# Weight maps the reference does not cover, compared across backends
+WEIGHT_MAP_SETS = (("saliency",), ("chromatic",), ("luminance", "saliency", "chromatic"))
+
+
+def timed(call: Callable[[], object], repeat: int) -> float:
+    """Return the median wall time of `call` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def bench_approach(name: str, image: np.ndarray, repeat: int) -> Dict[str, float]:
+    """Time every method of one approach class, each with inputs prepared beforehand."""
+    approach = APPROACH_CLASSES[name](image)
+    balanced = approach.white_balance()
+    contrast = approach.enhance_contrast()
+    maps1 = (
+        approach.luminance_weight_map(contrast),
+        approach.saliency_weight_map(contrast),
+        approach.chromatic_weight_map(contrast),
+    )
+    maps2 = (
+        approach.luminance_weight_map(balanced),
+        approach.saliency_weight_map(balanced),
+        approach.chromatic_weight_map(balanced),
+    )
+    enhanced1 = approach.apply_weight_maps(contrast, *maps1)
+    enhanced2 = approach.apply_weight_maps(balanced, *maps2)
+
+    calls = {
+        "white_balance": approach.white_balance,
+        "enhance_contrast": approach.enhance_contrast,
+        "luminance_weight_map": lambda: approach.luminance_weight_map(balanced),
+        "saliency_weight_map": lambda: approach.saliency_weight_map(balanced),
+        "chromatic_weight_map": lambda: approach.chromatic_weight_map(balanced),
+        "apply_weight_maps": lambda: approach.apply_weight_maps(balanced, *maps2),
+        "fuse_images": lambda: approach.fuse_images(enhanced1, enhanced2, maps1[0], maps2[0]),
+        "process_image": approach.process_image,
+    }
+    return {f"{name}.{method}": timed(call, repeat) for method, call in calls.items()}
+
+
+def bench_endpoint(image: np.ndarray, repeat: int) -> Dict[str, float]:
+    """Time a /filter-image round trip, from the JSON request to the decoded response."""
+    # Every request must run the pipeline rather than hit the result cache
+    os.environ["UNDERWATER_CACHE_BYTES"] = "0"
+    import main
+
+    client = main.app.test_client()
+    png = cv2.imencode(".png", image)[1].tobytes()
+    body = {"image": "data:image/png;base64," + base64.b64encode(png).decode()}
+
+    def round_trip() -> None:
+        response = client.post("/filter-image", json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"/filter-image answered {response.status_code}")
+        response.get_json()
+
+    return {"http.filter_image": timed(round_trip, repeat)}
+
+
+def check_equivalence(image: np.ndarray, tolerance: int) -> Dict[str, dict]:
+    """
+    Compare every code path producing an approach's output with the frozen reference, and the
+    opencv and umat backends with the numpy backend for the other weight maps and both fusion
+    modes, which the reference does not cover.
+
+    Returns:
+        Dict[str, dict]: For each path, the largest pixel difference, the fraction of pixels
+            that differ at all and whether the difference is within `tolerance`.
+    """
+    pipeline = FusionPipeline()
+    outputs = {
+        "process_image": {
+            name: cls(image.copy()).process_image() for name, cls in APPROACH_CLASSES.items()
+        },
+        "pipeline": pipeline.process(image),
+        "pipeline_tiled": pipeline.process_tiled(image, tile_rows=max(64, image.shape[0] // 4)),
+        "pipeline_opencv": FusionPipeline(backend="opencv").process(image),
+        "pipeline_umat": FusionPipeline(backend="umat").process(image),
+    }
+
+    report = {}
+    for name, function in reference.REFERENCES.items():
+        expected = function(image)
+        for path, results in outputs.items():
+            difference = cv2.absdiff(results[name], expected)
+            max_diff = int(difference.max())
+            report[f"{name}.{path}"] = {
+                "max_diff": max_diff,
+                "differing": round(float(np.count_nonzero(difference)) / difference.size, 6),
+                "ok": max_diff <= tolerance,
+            }
+
+    for weights in WEIGHT_MAP_SETS:
+        for fusion in ("weighted", "pyramid"):
+            variants = {
+                name: with_parameters(variant, fusion=fusion)
+                for name, variant in with_weight_maps(APPROACHES, weights).items()
+            }
+            expected = FusionPipeline(variants, backend="numpy").process(image)
+            for backend in ("opencv", "umat"):
+                results = FusionPipeline(variants, backend=backend).process(image)
+                for name in variants:
+                    difference = cv2.absdiff(results[name], expected[name])
+                    max_diff = int(difference.max())
+                    report[f"{name}.{'+'.join(weights)}.{fusion}.{backend}"] = {
+                        "max_diff": max_diff,
+                        "differing": round(
+                            float(np.count_nonzero(difference)) / difference.size, 6
+                        ),
+                        "ok": max_diff <= tolerance,
+                    }
+    return report
+
+
+def check_strips_and_batches(image: np.ndarray) -> Dict[str, dict]:
+    """
+    Compare process_tiled with process on the whole image, and process_batch with process
+    run frame by frame, for both fusion modes on every backend, with the default weight maps
+    and with all of them. Strips and batches must reproduce the whole image exactly.
+
+    Returns:
+        Dict[str, dict]: For each approach, fusion mode, backend and path, the largest pixel
+            difference and whether it is zero.
+    """
+    frames = np.stack([image, image[::-1], image[:, ::-1]])
+    all_maps = with_weight_maps(APPROACHES, WEIGHT_MAP_SETS[-1])
+    variants = {
+        f"{name}{suffix}.{fusion}": with_parameters(variant, fusion=fusion)
+        for suffix, approaches in (("", APPROACHES), (".all_maps", all_maps))
+        for name, variant in approaches.items()
+        for fusion in ("weighted", "pyramid")
+    }
+    report = {}
+    for backend in BACKENDS:
+        pipeline = FusionPipeline(variants, backend=backend)
+        batch = pipeline.process_batch(frames, frames_per_chunk=len(frames))
+        expected = [pipeline.process(frame) for frame in frames]
+        tiled = pipeline.process_tiled(image, tile_rows=max(64, image.shape[0] // 4))
+        for name in variants:
+            max_diff = max(
+                int(cv2.absdiff(batch[name][index], results[name]).max())
+                for index, results in enumerate(expected)
+            )
+            report[f"{name}.{backend}.batch"] = {"max_diff": max_diff, "ok": max_diff == 0}
+            max_diff = int(cv2.absdiff(tiled[name], expected[0][name]).max())
+            report[f"{name}.{backend}.tiled"] = {"max_diff": max_diff, "ok": max_diff == 0}
+    return report
+
+
+def check_zero_weights() -> Dict[str, dict]:
+    """
+    Fuse two flat 8-bit images whose weights are all 0 with every fusion kernel, including the
+    opencv and umat backends. Each must return their plain average; numexpr is skipped when it
+    is not installed.
+
+    Returns:
+        Dict[str, dict]: For each kernel, the fused value, the expected one and whether they
+            match.
+    """
+    image1 = np.full((32, 32, 3), 200, dtype=np.uint8)
+    image2 = np.full((32, 32, 3), 100, dtype=np.uint8)
+    zeros = np.zeros((32, 32), dtype=np.float32)
+    report = {}
+    for method in ("numpy", "opencv", "numexpr"):
+        if method == "numexpr" and blending.numexpr is None:
+            report[method] = {"skipped": "numexpr is not installed", "ok": True}
+            continue
+        fused = blending.fuse_weighted(image1, image2, zeros, zeros, method=method)
+        values = sorted({int(value) for value in np.unique(fused)})
+        report[method] = {"values": values, "expected": [150], "ok": values == [150]}
+    for backend, wrap in (("opencv", lambda plane: plane), ("umat", backends.upload)):
+        fused = backends.download(
+            backends.fuse_weighted(wrap(image1), wrap(image2), wrap(zeros), wrap(zeros))
+        )
+        values = sorted({int(value) for value in np.unique(fused)})
+        report[f"backend.{backend}"] = {
+            "values": values,
+            "expected": [150],
+            "ok": values == [150],
+        }
+    return report
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Print every timing next to its baseline and return the ones slower by more than
+    `threshold` (a fraction).
+    """
+    regressions = []
+    for size, current in results["sizes"].items():
+        previous = baseline.get("sizes", {}).get(size, {}).get("timings_ms", {})
+        for key, value in current["timings_ms"].items():
+            if key not in previous or not previous[key]:
+                continue
+            ratio = value / previous[key]
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{size} {key}")
+            print(
+                f"{size:>6} {key:<36} {previous[key]:>10.1f} -> {value:>10.1f} ms "
+                f"({ratio:.2f}x){flag}"
+            )
+    return regressions
+
+
+def environment() -> Dict[str, object]:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the underwater enhancement.")
+    parser.add_argument(
+        "--sizes", type=float, nargs="+", default=list(SIZES), help="image sizes in megapixels"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement")
+    parser.add_argument("-o", "--output", default="results.json", help="results JSON file")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write the results to this file")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="slowdown reported as a regression"
+    )
+    parser.add_argument("--no-http", action="store_true", help="skip the endpoint round trip")
+    parser.add_argument(
+        "--check-up-to",
+        type=float,
+        default=12,
+        help="largest size (MP) checked against the reference, which needs a lot of memory",
+    )
+    parser.add_argument(
+        "--tolerance", type=int, default=1, help="largest pixel difference from the reference"
+    )
+    args = parser.parse_args(argv)
+
+    results = {"environment": environment(), "sizes": {}}
+    results["zero_weights"] = check_zero_weights()
+    failed = False
+    for kernel, report in results["zero_weights"].items():
+        if not report["ok"]:
+            failed = True
+            print(f"{kernel} fuses zero weights to {report['values']}", file=sys.stderr)
+    for size in args.sizes:
+        key = f"{size:g}MP"
+        image = synthetic.underwater_image(size)
+        print(f"{key}: {image.shape[1]}x{image.shape[0]}", file=sys.stderr)
+
+        timings = {}
+        for name in APPROACH_CLASSES:
+            timings.update(bench_approach(name, image, args.repeat))
+        for backend in BACKENDS:
+            pipeline = FusionPipeline(backend=backend)
+            # The NumPy backend keeps the key of baselines from before the backends existed
+            label = "pipeline.process" if backend == "numpy" else f"pipeline.process.{backend}"
+            timings[label] = timed(lambda: pipeline.process(image), args.repeat)
+        if not args.no_http:
+            timings.update(bench_endpoint(image, args.repeat))
+        entry = {"shape": list(image.shape), "timings_ms": timings}
+
+        if size <= args.check_up_to:
+            entry["equivalence"] = check_equivalence(image, args.tolerance)
+            for path, report in entry["equivalence"].items():
+                if not report["ok"]:
+                    failed = True
+                    print(f"{key} {path} differs by {report['max_diff']}", file=sys.stderr)
+            entry["consistency"] = check_strips_and_batches(image)
+            for path, report in entry["consistency"].items():
+                if not report["ok"]:
+                    failed = True
+                    print(f"{key} {path} differs by {report['max_diff']}", file=sys.stderr)
+        results["sizes"][key] = entry
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
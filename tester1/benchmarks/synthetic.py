@@ -0,0 +1,65 @@
+"""
+Synthetic underwater photos for benchmarking.
+
+Real dive photos cannot be shipped with the repository, so the benchmarks use generated scenes
+with the traits that matter to the enhancement: a blue/green cast, red light fading with depth,
+low contrast, a few sharp objects and sensor noise.
+"""
+import math
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+
+def image_size(megapixels: float, aspect: float = 4 / 3) -> Tuple[int, int]:
+    """
+    Return the (height, width) of a 4:3 image with about `megapixels` million pixels.
+    """
+    width = int(round(math.sqrt(megapixels * 1_000_000 * aspect)))
+    height = int(round(width / aspect))
+    return height, width
+
+
+def underwater_image(megapixels: float, seed: int = 0) -> np.ndarray:
+    """
+    Generate an underwater-looking BGR photo.
+
+    Args:
+        megapixels (float): The size of the image in millions of pixels.
+        seed (int): Seed of the objects and the noise.
+
+    Returns:
+        np.ndarray: The 8-bit BGR image.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = image_size(megapixels)
+
+    # Water column: brighter towards the surface, red absorbed first, blue last
+    depth = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, np.newaxis]
+    across = np.linspace(-1.0, 1.0, width, dtype=np.float32)[np.newaxis, :]
+    light = (0.9 - 0.5 * depth) * (1.0 - 0.15 * across**2)
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[:, :, 0] = 170 * light  # blue
+    image[:, :, 1] = 140 * light  # green
+    image[:, :, 2] = 45 * light * (1.0 - 0.6 * depth)  # red
+
+    # Rocks, fish and coral as low contrast blobs with sharp edges
+    scale = min(height, width)
+    for _ in range(40):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = tuple(int(axis) for axis in rng.integers(scale // 60, scale // 8, size=2))
+        color = (
+            float(rng.uniform(40, 150)),
+            float(rng.uniform(50, 160)),
+            float(rng.uniform(20, 120)),
+        )
+        cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, color, -1)
+
+    # Haze over the objects, then sensor noise
+    cv2.GaussianBlur(image, (0, 0), sigmaX=max(1.0, scale / 800), dst=image)
+    noise = rng.standard_normal((height, width, 3), dtype=np.float32)
+    noise *= 6.0
+    image += noise
+    np.clip(image, 0, 255, out=image)
+    return image.astype(np.uint8)
@@ -1,16 +1,29 @@
+from typing import Optional, Sequence
+
 import cv2
 import numpy as np
 
+from approaches.blending import fuse_weighted
+from approaches.instrumentation import instrumented
+from approaches import stages
+from approaches.stages import GrayWorldWhiteBalance
+
 class Approach1:
-    def __init__(self, image: np.ndarray) -> None:
+    def __init__(
+        self, image: np.ndarray, weight_maps: Sequence[str] = ("luminance",)
+    ) -> None:
         """
         Initialize the class with an image
 
         Args:
             image (numpy.ndarray): The input image expected in BGR format.
+            weight_maps (Sequence[str]): The weight maps ("luminance", "saliency",
+                "chromatic") whose sum weights each image in the fusion.
         """
         self.image = image
+        self.weight_maps = tuple(weight_maps)
 
+    @instrumented("approach1.enhance_contrast")
     def enhance_contrast(self) -> np.ndarray:
         """
         Enhance the contrast of an image stored in the instance variable `self.image`. The method
@@ -34,6 +47,7 @@ class Approach1:
 
         return eq
 
+    @instrumented("approach1.white_balance")
     def white_balance(self) -> np.ndarray:
         """
         Applies white balance correction to an image using the gray world assumption. This method
@@ -47,35 +61,11 @@ class Approach1:
             # Convert BGRA to BGR
             self.image = cv2.cvtColor(self.image, cv2.COLOR_BGRA2BGR)
 
-        # Convert the image from 8-bit to 32-bit floating point for accurate calculations
-        image = self.image.astype(np.float32)
-
-        # Split the image into its Blue, Green, and Red components
-        b, g, r = cv2.split(image)
-
-        # Compute the average intensity for each channel
-        avg_b = np.mean(b)
-        avg_g = np.mean(g)
-        avg_r = np.mean(r)
-
-        # Calculate the average intensity of all channels (Gray world assumption)
-        gray_value = (avg_b + avg_g + avg_r) / 3
-
-        # Calculate correction factors for each channel to equalize the average intensities
-        coeff_b = gray_value / avg_b
-        coeff_g = gray_value / avg_g
-        coeff_r = gray_value / avg_r
-
-        # Scale each channel by its respective correction factor and clip the results to the valid range
-        b = np.clip(b * coeff_b, 0, 255).astype(np.uint8)
-        g = np.clip(g * coeff_g, 0, 255).astype(np.uint8)
-        r = np.clip(r * coeff_r, 0, 255).astype(np.uint8)
-
-        # Reassemble the corrected channels back into a single BGR image
-        balanced_img = cv2.merge([b, g, r])
-
-        return balanced_img
+        # Channel averages come from 256-bin histograms and the correction factors are applied
+        # with a per-channel lookup table, without any floating point copy of the image
+        return GrayWorldWhiteBalance()(self.image)
 
+    @instrumented("approach1.luminance_weight_map")
     def luminance_weight_map(self, img: np.ndarray) -> np.ndarray:
         """
         Calculate a luminance weight map from a given image. The method converts the image
@@ -100,6 +90,7 @@ class Approach1:
 
         return luminance_weights
 
+    @instrumented("approach1.saliency_weight_map")
     def saliency_weight_map(self, img: np.ndarray) -> np.ndarray:
         """
         Generates a saliency weight map for an input image using the Laplacian of Gaussian method.
@@ -111,24 +102,11 @@ class Approach1:
         Returns:
             np.ndarray: A saliency weight map of the image, normalized to the range [0, 1].
         """
-        # Convert the image to grayscale
-        if len(img.shape) < 3:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Use Laplacian of Gaussian for edge detection
-        saliency = cv2.Laplacian(gray, cv2.CV_64F)
-
-        # Get the absolute values to form the saliency map
-        saliency = np.absolute(saliency)
-
-        # Normalize the saliency map
-        saliency = cv2.normalize(
-            saliency, None, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_32F
-        )
-
-        return saliency
+        # The Laplacian is taken in 16-bit integers, which hold it exactly, and normalized to
+        # float32 without a float64 copy of the image
+        return stages.saliency_weight_map(img)
 
+    @instrumented("approach1.chromatic_weight_map")
     def chromatic_weight_map(self, img: np.ndarray) -> np.ndarray:
         """
         Generates a chromatic weight map for an input image by normalizing the saturation channel
@@ -141,21 +119,16 @@ class Approach1:
         Returns:
             np.ndarray: A chromatic weight map with values normalized between 0 and 1.
         """
-        # Convert image to HSV to access the saturation channel
-        if len(img.shape) < 3:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        saturation = hsv[:, :, 1]  # Saturation channel
-        # Normalize the saturation channel to use as weights
-        chromatic_weights = saturation / 255.0
-        return chromatic_weights
+        # Saturation channel of the HSV image, normalized in float32
+        return stages.chromatic_weight_map(img)
 
+    @instrumented("approach1.apply_weight_maps")
     def apply_weight_maps(
         self,
         img: np.ndarray,
         luminance_map: np.ndarray,
-        saliency_map: np.ndarray,
-        chromatic_map: np.ndarray,
+        saliency_map: Optional[np.ndarray] = None,
+        chromatic_map: Optional[np.ndarray] = None,
     ) -> np.ndarray:
         """
         Applies provided weight maps (luminance, saliency, and chromatic) to the lightness channel of
@@ -165,8 +138,10 @@ class Approach1:
         Args:
             img (np.ndarray): An input image in BGR format.
             luminance_map (np.ndarray): A weight map based on the luminance of the image.
-            saliency_map (np.ndarray): A weight map based on the saliency of the image.
-            chromatic_map (np.ndarray): A weight map based on the chromaticity of the image.
+            saliency_map (Optional[np.ndarray]): A weight map based on the saliency of the image.
+                Accepted for compatibility; it does not change the lightness.
+            chromatic_map (Optional[np.ndarray]): A weight map based on the chromaticity of the
+                image. Accepted for compatibility; it does not change the lightness.
 
         Returns:
             np.ndarray: The processed image in BGR format, with modified lightness based on the applied weights.
@@ -177,15 +152,12 @@ class Approach1:
 
         img = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
 
-        # 2. Ensure weight maps have the same dimensions as the image
+        # 2. Ensure the luminance map has the same dimensions as the image; only the luminance
+        # map weights the lightness, so the other maps are neither resized nor normalized
         luminance_map = cv2.resize(luminance_map, (img.shape[1], img.shape[0]))
-        saliency_map = cv2.resize(saliency_map, (img.shape[1], img.shape[0]))
-        chromatic_map = cv2.resize(chromatic_map, (img.shape[1], img.shape[0]))
 
-        # 3. Normalize weight maps
+        # 3. Normalize the luminance map
         luminance_map = luminance_map.astype(np.float32) / 255.0
-        saliency_map = saliency_map.astype(np.float32) / 255.0
-        chromatic_map = chromatic_map.astype(np.float32) / 255.0
 
         # 4. Extract lightness (L), A, and B channels from LAB image
         l, a, b = cv2.split(img)
@@ -212,6 +184,7 @@ class Approach1:
 
         return img
 
+    @instrumented("approach1.fuse_images")
     def fuse_images(
         self,
         image1: np.ndarray,
@@ -243,60 +216,41 @@ class Approach1:
                 "Images and weight maps must have the same spatial dimensions!"
             )
 
-        # Reshape weight maps to match image channels (if necessary)
-        if weight_map1.ndim < image1.ndim:
-            weight_map1 = weight_map1.reshape(
-                (weight_map1.shape[0], weight_map1.shape[1], 1)
-            )
-        if weight_map2.ndim < image2.ndim:
-            weight_map2 = weight_map2.reshape(
-                (weight_map2.shape[0], weight_map2.shape[1], 1)
-            )
-
-        # Simple averaging with weight maps
-        fused_image = (image1 * weight_map1 + image2 * weight_map2) / (
-            weight_map1 + weight_map2
-        )
-
-        # Clip pixel values to [0, 255] (assuming uint8 images)
-        fused_image = np.clip(fused_image, 0, 255).astype(np.uint8)
-
-        return fused_image
+        # Weighted average in float32; pixels where both weights are 0 get the plain average
+        return fuse_weighted(image1, image2, weight_map1, weight_map2)
 
+    @instrumented("approach1.process_image")
     def process_image(self) -> np.ndarray:
         """
         The processing steps are:
             1. Apply white balance and contrast enhancements to the original image.
-            2. Generate chromatic, saliency, and luminance weight maps for both the contrast-enhanced and
-            white-balanced images.
-            3. Combine these maps with the original images to create enhanced versions.
-            4. Fuse the two enhanced images into a final image based on luminance comparisons.
+            2. Generate the luminance weight maps of the contrast-enhanced and white-balanced
+            images, plus the saliency and chromatic maps when `self.weight_maps` selects them.
+            3. Combine the luminance maps with the images to create enhanced versions.
+            4. Fuse the two enhanced images into a final image weighted by the selected maps.
         """
         # Apply white balance and contrast enhancements
         white_balance_img = self.white_balance()
         contrast_img = self.enhance_contrast()
 
-        # Generate weight maps for the contrast-enhanced image
-        chromatic_map1 = self.chromatic_weight_map(contrast_img)
-        saliency_map1 = self.saliency_weight_map(contrast_img)
+        # The luminance maps weight the lightness of both images
         luminance_map1 = self.luminance_weight_map(contrast_img)
-
-        # Generate weight maps for the white-balanced image
-        chromatic_map2 = self.chromatic_weight_map(white_balance_img)
-        saliency_map2 = self.saliency_weight_map(white_balance_img)
         luminance_map2 = self.luminance_weight_map(white_balance_img)
 
         # Apply weighted maps to enhance images
-        enhanced_image1 = self.apply_weight_maps(
-            contrast_img, luminance_map1, saliency_map1, chromatic_map1
-        )
-        enhanced_image2 = self.apply_weight_maps(
-            white_balance_img, luminance_map2, saliency_map2, chromatic_map2
-        )
-        
+        enhanced_image1 = self.apply_weight_maps(contrast_img, luminance_map1)
+        enhanced_image2 = self.apply_weight_maps(white_balance_img, luminance_map2)
+
         # Fuse the two enhanced images into the final image
         return self.fuse_images(
-            enhanced_image1, enhanced_image2, luminance_map1, luminance_map2
+            enhanced_image1,
+            enhanced_image2,
+            stages.fusion_weight_map(
+                contrast_img, self.weight_maps, {"luminance": luminance_map1}
+            ),
+            stages.fusion_weight_map(
+                white_balance_img, self.weight_maps, {"luminance": luminance_map2}
+            ),
         )
 
 if __name__ == "__main__":
@@ -1,16 +1,29 @@
+from typing import Optional, Sequence
+
 import cv2
 import numpy as np
 
+from approaches.blending import fuse_weighted
+from approaches.instrumentation import instrumented
+from approaches import stages
+from approaches.stages import Clahe, PercentileWhiteBalance
+
 class Approach2:
-    def __init__(self, image: np.ndarray) -> None:
+    def __init__(
+        self, image: np.ndarray, weight_maps: Sequence[str] = ("luminance",)
+    ) -> None:
         """
         Initialize the class with an image
 
         Args:
             image (numpy.ndarray): The input image expected in BGR format.
+            weight_maps (Sequence[str]): The weight maps ("luminance", "saliency",
+                "chromatic") whose sum weights each image in the fusion.
         """
         self.image = image
+        self.weight_maps = tuple(weight_maps)
 
+    @instrumented("approach2.enhance_contrast")
     def enhance_contrast(self) -> np.ndarray:
         """
         Enhance the contrast of an image stored in the instance variable `self.image`. This method
@@ -31,13 +44,13 @@ class Approach2:
             # Image is already grayscale
             gray = self.image
 
-        # Create a CLAHE object with parameters for contrast limiting and grid size
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        # Apply CLAHE to the grayscale image to enhance contrast
-        enhanced_image = clahe.apply(gray)
+        # Apply CLAHE (clip limit 2.0, 8x8 grid) to the grayscale image to enhance contrast; the
+        # CLAHE object is created once per thread and reused
+        enhanced_image = Clahe(clip_limit=2.0, tile_grid=(8, 8))(gray)
 
         return enhanced_image
 
+    @instrumented("approach2.white_balance")
     def white_balance(self) -> np.ndarray:
         """
         Adjusts the white balance of an image stored in the instance variable `self.image` by
@@ -52,17 +65,11 @@ class Approach2:
         if self.image.shape[2] == 4:
             self.image = cv2.cvtColor(self.image, cv2.COLOR_BGRA2BGR)
 
-        # Convert image to double precision for accurate calculations
-        double_img = self.image.astype(np.float64)
-
-        # Find the maximum values in each channel at the 99th percentil
-        max_values = np.percentile(double_img, 99, axis=(0, 1))
-
-        # Scale the image based on these maximum values to adjust white balance
-        balanced_img = (double_img / max_values * 255).clip(0, 255).astype(np.uint8)
-
-        return balanced_img
+        # The 99th percentile of each channel is read off its 256-bin histogram and the scaling
+        # is applied with a per-channel lookup table
+        return PercentileWhiteBalance()(self.image)
 
+    @instrumented("approach2.luminance_weight_map")
     def luminance_weight_map(self, img: np.ndarray) -> np.ndarray:
         """
         Calculate a luminance weight map from a given image. The method converts the image
@@ -87,6 +94,7 @@ class Approach2:
 
         return luminance_weights
 
+    @instrumented("approach2.saliency_weight_map")
     def saliency_weight_map(self, img: np.ndarray) -> np.ndarray:
         """
         Generates a saliency weight map for an input image using the Laplacian of Gaussian method.
@@ -98,24 +106,11 @@ class Approach2:
         Returns:
             np.ndarray: A saliency weight map of the image, normalized to the range [0, 1].
         """
-        # Convert the image to grayscale
-        if len(img.shape) < 3:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Use Laplacian of Gaussian for edge detection
-        saliency = cv2.Laplacian(gray, cv2.CV_64F)
-
-        # Get the absolute values to form the saliency map
-        saliency = np.absolute(saliency)
-
-        # Normalize the saliency map
-        saliency = cv2.normalize(
-            saliency, None, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_32F
-        )
-
-        return saliency
+        # The Laplacian is taken in 16-bit integers, which hold it exactly, and normalized to
+        # float32 without a float64 copy of the image
+        return stages.saliency_weight_map(img)
 
+    @instrumented("approach2.chromatic_weight_map")
     def chromatic_weight_map(self, img: np.ndarray) -> np.ndarray:
         """
         Generates a chromatic weight map for an input image by normalizing the saturation channel
@@ -128,21 +123,16 @@ class Approach2:
         Returns:
             np.ndarray: A chromatic weight map with values normalized between 0 and 1.
         """
-        # Convert image to HSV to access the saturation channel
-        if len(img.shape) < 3:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        saturation = hsv[:, :, 1]  # Saturation channel
-        # Normalize the saturation channel to use as weights
-        chromatic_weights = saturation / 255.0
-        return chromatic_weights
+        # Saturation channel of the HSV image, normalized in float32
+        return stages.chromatic_weight_map(img)
 
+    @instrumented("approach2.apply_weight_maps")
     def apply_weight_maps(
         self,
         img: np.ndarray,
         luminance_map: np.ndarray,
-        saliency_map: np.ndarray,
-        chromatic_map: np.ndarray,
+        saliency_map: Optional[np.ndarray] = None,
+        chromatic_map: Optional[np.ndarray] = None,
     ) -> np.ndarray:
         """
         Applies provided weight maps (luminance, saliency, and chromatic) to the lightness channel of
@@ -152,8 +142,10 @@ class Approach2:
         Args:
             img (np.ndarray): An input image in BGR format.
             luminance_map (np.ndarray): A weight map based on the luminance of the image.
-            saliency_map (np.ndarray): A weight map based on the saliency of the image.
-            chromatic_map (np.ndarray): A weight map based on the chromaticity of the image.
+            saliency_map (Optional[np.ndarray]): A weight map based on the saliency of the image.
+                Accepted for compatibility; it does not change the lightness.
+            chromatic_map (Optional[np.ndarray]): A weight map based on the chromaticity of the
+                image. Accepted for compatibility; it does not change the lightness.
 
         Returns:
             np.ndarray: The processed image in BGR format, with modified lightness based on the applied weights.
@@ -164,15 +156,12 @@ class Approach2:
 
         img = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
 
-        # 2. Ensure weight maps have the same dimensions as the image
+        # 2. Ensure the luminance map has the same dimensions as the image; only the luminance
+        # map weights the lightness, so the other maps are neither resized nor normalized
         luminance_map = cv2.resize(luminance_map, (img.shape[1], img.shape[0]))
-        saliency_map = cv2.resize(saliency_map, (img.shape[1], img.shape[0]))
-        chromatic_map = cv2.resize(chromatic_map, (img.shape[1], img.shape[0]))
 
-        # 3. Normalize weight maps
+        # 3. Normalize the luminance map
         luminance_map = luminance_map.astype(np.float32) / 255.0
-        saliency_map = saliency_map.astype(np.float32) / 255.0
-        chromatic_map = chromatic_map.astype(np.float32) / 255.0
 
         # 4. Extract lightness (L), A, and B channels from LAB image
         l, a, b = cv2.split(img)
@@ -199,6 +188,7 @@ class Approach2:
 
         return img
 
+    @instrumented("approach2.fuse_images")
     def fuse_images(
         self,
         image1: np.ndarray,
@@ -230,60 +220,41 @@ class Approach2:
                 "Images and weight maps must have the same spatial dimensions!"
             )
 
-        # Reshape weight maps to match image channels (if necessary)
-        if weight_map1.ndim < image1.ndim:
-            weight_map1 = weight_map1.reshape(
-                (weight_map1.shape[0], weight_map1.shape[1], 1)
-            )
-        if weight_map2.ndim < image2.ndim:
-            weight_map2 = weight_map2.reshape(
-                (weight_map2.shape[0], weight_map2.shape[1], 1)
-            )
-
-        # Simple averaging with weight maps
-        fused_image = (image1 * weight_map1 + image2 * weight_map2) / (
-            weight_map1 + weight_map2
-        )
-
-        # Clip pixel values to [0, 255] (assuming uint8 images)
-        fused_image = np.clip(fused_image, 0, 255).astype(np.uint8)
-
-        return fused_image
+        # Weighted average in float32; pixels where both weights are 0 get the plain average
+        return fuse_weighted(image1, image2, weight_map1, weight_map2)
 
+    @instrumented("approach2.process_image")
     def process_image(self) -> np.ndarray:
         """
         The processing steps are:
             1. Apply white balance and contrast enhancements to the original image.
-            2. Generate chromatic, saliency, and luminance weight maps for both the contrast-enhanced and
-            white-balanced images.
-            3. Combine these maps with the original images to create enhanced versions.
-            4. Fuse the two enhanced images into a final image based on luminance comparisons.
+            2. Generate the luminance weight maps of the contrast-enhanced and white-balanced
+            images, plus the saliency and chromatic maps when `self.weight_maps` selects them.
+            3. Combine the luminance maps with the images to create enhanced versions.
+            4. Fuse the two enhanced images into a final image weighted by the selected maps.
         """
         # Apply white balance and contrast enhancements
         white_balance_img = self.white_balance()
         contrast_img = self.enhance_contrast()
 
-        # Generate weight maps for the contrast-enhanced image
-        chromatic_map1 = self.chromatic_weight_map(contrast_img)
-        saliency_map1 = self.saliency_weight_map(contrast_img)
+        # The luminance maps weight the lightness of both images
         luminance_map1 = self.luminance_weight_map(contrast_img)
-
-        # Generate weight maps for the white-balanced image
-        chromatic_map2 = self.chromatic_weight_map(white_balance_img)
-        saliency_map2 = self.saliency_weight_map(white_balance_img)
         luminance_map2 = self.luminance_weight_map(white_balance_img)
 
         # Apply weighted maps to enhance images
-        enhanced_image1 = self.apply_weight_maps(
-            contrast_img, luminance_map1, saliency_map1, chromatic_map1
-        )
-        enhanced_image2 = self.apply_weight_maps(
-            white_balance_img, luminance_map2, saliency_map2, chromatic_map2
-        )
+        enhanced_image1 = self.apply_weight_maps(contrast_img, luminance_map1)
+        enhanced_image2 = self.apply_weight_maps(white_balance_img, luminance_map2)
 
         # Fuse the two enhanced images into the final image
         return self.fuse_images(
-            enhanced_image1, enhanced_image2, luminance_map1, luminance_map2
+            enhanced_image1,
+            enhanced_image2,
+            stages.fusion_weight_map(
+                contrast_img, self.weight_maps, {"luminance": luminance_map1}
+            ),
+            stages.fusion_weight_map(
+                white_balance_img, self.weight_maps, {"luminance": luminance_map2}
+            ),
         )
 
 if __name__ == "__main__":
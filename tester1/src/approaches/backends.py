@@ -0,0 +1,296 @@
+"""
+Execution backends of the fusion graph.
+
+The "numpy" backend is the reference: the weight maps, the lightness weighting and the fusion
+in stages.py and blending.py mix NumPy arithmetic with cv2 calls. The "opencv" backend runs the
+same steps on cv2 primitives only (cv2.multiply, cv2.add, cv2.compare, cv2.extractChannel,
+cv2.blendLinear and the pyramid functions). That avoids the NumPy temporaries and float64
+planes, and lets OpenCV's thread pool parallelize the fused section. The "umat" backend runs
+the same functions on cv2.UMat. OpenCV's transparent API then dispatches them to an OpenCL
+device when one is available, which may be a CPU OpenCL runtime, and to the same CPU code
+otherwise.
+
+The white balance and contrast stages themselves are unchanged in every backend. For 8-bit
+images the backends agree with the reference within one intensity level, for every weight
+map and both fusion modes. That difference comes from blendLinear, which rounds where the
+NumPy kernel truncates, and the benchmark checks it.
+"""
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+
+from approaches import blending
+from approaches.stages import conversion, max_value, scale_to_unit
+
+BACKENDS = ("numpy", "opencv", "umat")
+
+# "numpy" (reference), "opencv" (cv2 primitives) or "umat" (cv2 primitives on cv2.UMat)
+DEFAULT_BACKEND = os.environ.get("UNDERWATER_BACKEND", "numpy")
+
+Plane = Union[np.ndarray, "cv2.UMat"]
+
+
+def configure_threads(threads: Optional[int] = None) -> int:
+    """
+    Size OpenCV's thread pool for this process. Each server or batch worker calls this once,
+    so that workers times threads matches the cores of the machine.
+
+    Args:
+        threads (Optional[int]): The number of threads, 0 or 1 to run OpenCV single-threaded.
+            Defaults to UNDERWATER_OPENCV_THREADS, and when that is unset too, OpenCV's own
+            default of one thread per core is kept.
+
+    Returns:
+        int: The number of threads OpenCV now uses.
+    """
+    if threads is None and os.environ.get("UNDERWATER_OPENCV_THREADS"):
+        threads = int(os.environ["UNDERWATER_OPENCV_THREADS"])
+    if threads is not None:
+        if threads < 0:
+            raise ValueError("The number of OpenCV threads cannot be negative")
+        cv2.setNumThreads(threads)
+    return cv2.getNumThreads()
+
+
+def check_backend(backend: str) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    return backend
+
+
+def upload(image: np.ndarray) -> "cv2.UMat":
+    return cv2.UMat(np.ascontiguousarray(image))
+
+
+def download(image: Plane) -> np.ndarray:
+    return image.get() if isinstance(image, cv2.UMat) else image
+
+
+def _is_gray(img: Plane) -> bool:
+    # UMat planes are always the 3-channel branch images, see FusionGraph
+    return isinstance(img, np.ndarray) and img.ndim == 2
+
+
+def _white(img: Plane) -> float:
+    # The UMat backend only runs 8-bit images
+    return 255.0 if isinstance(img, cv2.UMat) else max_value(img.dtype)
+
+
+def _is_uint8(img: Plane) -> bool:
+    return isinstance(img, cv2.UMat) or img.dtype == np.uint8
+
+
+def _to_float(img: Plane) -> Plane:
+    return cv2.add(img, 0, dtype=cv2.CV_32F)
+
+
+def luminance_weight_map(img: Plane, color_order: str = "bgr") -> Plane:
+    """
+    The float32 luminance weight map of `stages.luminance_weight_map`: the Y channel of the
+    image scaled to [0, 1].
+
+    Args:
+        img (Plane): A grayscale or color image, as an array or a UMat.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+
+    Returns:
+        Plane: The normalized luminance weights.
+    """
+    luminance = img
+    if not _is_gray(img):
+        luminance = cv2.extractChannel(cv2.cvtColor(img, conversion(color_order, "yuv")), 0)
+    return cv2.divide(_to_float(luminance), _white(img))
+
+
+def saliency_weight_map(
+    img: Plane, color_order: str = "bgr", value_range: Optional[Tuple[float, float]] = None
+) -> Plane:
+    """
+    The float32 saliency weight map of `stages.saliency_weight_map`: the magnitude of the
+    Laplacian of the grayscale image, min-max normalized to [0, 1].
+
+    Args:
+        img (Plane): A grayscale or color image, as an array or a UMat.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+        value_range (Optional[Tuple[float, float]]): The smallest and largest magnitude to
+            normalize by, those of `img` when None.
+
+    Returns:
+        Plane: The normalized saliency weights.
+    """
+    gray = img if _is_gray(img) else cv2.cvtColor(img, conversion(color_order, "gray"))
+    depth = cv2.CV_16S if _is_uint8(img) else cv2.CV_32F
+    saliency = cv2.absdiff(cv2.Laplacian(gray, depth), 0)
+    if value_range is not None:
+        return scale_to_unit(saliency, value_range)
+    return cv2.normalize(
+        saliency, None, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_32F
+    )
+
+
+def chromatic_weight_map(img: Plane, color_order: str = "bgr") -> Plane:
+    """
+    The float32 chromatic weight map of `stages.chromatic_weight_map`: the HSV saturation
+    scaled to [0, 1], zero for grayscale images.
+
+    Args:
+        img (Plane): A grayscale or color image, as an array or a UMat.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+
+    Returns:
+        Plane: The normalized chromatic weights.
+    """
+    if _is_gray(img):
+        return np.zeros(img.shape, dtype=np.float32)
+    code = conversion(color_order, "hsv")
+    if _is_uint8(img):
+        return cv2.divide(_to_float(cv2.extractChannel(cv2.cvtColor(img, code), 1)), 255.0)
+    # float32 HSV saturation is already in [0, 1]
+    scaled = cv2.divide(_to_float(img), _white(img))
+    return cv2.extractChannel(cv2.cvtColor(scaled, code), 1)
+
+
+WEIGHT_MAPS: Dict[str, Callable[[Plane, str], Plane]] = {
+    "luminance": luminance_weight_map,
+    "saliency": saliency_weight_map,
+    "chromatic": chromatic_weight_map,
+}
+
+
+def combine_weight_maps(maps: Sequence[Plane]) -> Plane:
+    """Add up the weight maps of one fusion input with cv2.add."""
+    combined = maps[0]
+    for weight_map in maps[1:]:
+        combined = cv2.add(combined, weight_map, dtype=cv2.CV_32F)
+    return combined
+
+
+def apply_luminance_map(img: Plane, luminance_map: Plane, color_order: str = "bgr") -> Plane:
+    """
+    `stages.apply_luminance_map` on cv2 primitives, with the same float32 operations, so the
+    result is identical. `L * w + (1 - w) * L` differs from L only by rounding, and its
+    truncation to 8 bits is L minus one wherever the sum falls below L, which cv2.compare
+    finds without a float-to-int conversion that would round instead.
+
+    Args:
+        img (Plane): A color image, as an array or a UMat.
+        luminance_map (Plane): The luminance weight map of the image.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+
+    Returns:
+        Plane: The processed image.
+    """
+    if not _is_uint8(img):
+        return img
+    lab = cv2.cvtColor(img, conversion(color_order, "lab"))
+    lightness = cv2.extractChannel(lab, 0)
+
+    # Weights are normalized a second time, exactly as the approaches do
+    weights = cv2.divide(_to_float(luminance_map), 255.0)
+    weighted = cv2.multiply(lightness, weights, dtype=cv2.CV_32F)
+    complement = cv2.addWeighted(weights, -1.0, weights, 0.0, 1.0)
+    rest = cv2.multiply(complement, lightness, dtype=cv2.CV_32F)
+    below = cv2.compare(cv2.add(weighted, rest), _to_float(lightness), cv2.CMP_LT)
+    lightness = cv2.subtract(lightness, 1, dst=lightness, mask=below)
+
+    cv2.insertChannel(lightness, lab, 0)
+    return cv2.cvtColor(lab, conversion(color_order, "from_lab"))
+
+
+def fuse_weighted(
+    image1: Plane,
+    image2: Plane,
+    weight_map1: Plane,
+    weight_map2: Plane,
+    eps: float = blending.EPSILON,
+) -> Plane:
+    """
+    Weighted average of two images with cv2.blendLinear, which runs in parallel. 16-bit
+    arrays, which blendLinear does not support, use the NumPy kernel.
+
+    Args:
+        image1 (Plane): The first image.
+        image2 (Plane): The second image, of the same type.
+        weight_map1 (Plane): The single-channel weight map of the first image.
+        weight_map2 (Plane): The single-channel weight map of the second image.
+        eps (float): Added to both weights to handle pixels where both weights are 0.
+
+    Returns:
+        Plane: The fused image.
+    """
+    if isinstance(image1, np.ndarray) and image1.dtype == np.uint16:
+        return blending.fuse_weighted(image1, image2, weight_map1, weight_map2, method="numpy")
+    # blendLinear divides by w1 + w2 + 1e-5, which would swamp eps where both weights are
+    # 0, so it gets the normalized weights alpha and 1 - alpha of the NumPy kernel
+    weight1 = cv2.add(weight_map1, eps, dtype=cv2.CV_32F)
+    total = cv2.add(weight1, cv2.add(weight_map2, eps, dtype=cv2.CV_32F))
+    alpha = cv2.divide(weight1, total)
+    complement = cv2.addWeighted(alpha, -1.0, alpha, 0.0, 1.0)
+    return cv2.blendLinear(image1, image2, alpha, complement)
+
+
+def _gaussian_pyramid(image: Plane, levels: int) -> List[Plane]:
+    pyramid = [image]
+    for _ in range(levels - 1):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def fuse_pyramid(
+    images: Sequence[Plane],
+    weight_maps: Sequence[Plane],
+    size: Tuple[int, int],
+    levels: int = 5,
+    eps: float = blending.EPSILON,
+) -> Plane:
+    """
+    `blending.fuse_pyramid` on cv2 primitives. The result is rounded rather than truncated
+    to the image dtype.
+
+    Args:
+        images (Sequence[Plane]): The color images to fuse, of one type.
+        weight_maps (Sequence[Plane]): The single-channel weight map of each image.
+        size (Tuple[int, int]): The (width, height) of the images, which UMat does not
+            expose.
+        levels (int): The number of pyramid levels, reduced for small images.
+        eps (float): Added to every weight to handle pixels where all weights are 0.
+
+    Returns:
+        Plane: The fused image.
+    """
+    width, height = size
+    levels = max(1, min(levels, int(np.log2(max(1, min(height, width))))))
+    # The size of every level, as cv2.pyrDown rounds it
+    sizes = [size]
+    for _ in range(levels - 1):
+        sizes.append(((sizes[-1][0] + 1) // 2, (sizes[-1][1] + 1) // 2))
+    depth = cv2.CV_8U if _is_uint8(images[0]) else (
+        cv2.CV_16U if images[0].dtype == np.uint16 else cv2.CV_32F
+    )
+
+    weights = [cv2.add(weight, eps, dtype=cv2.CV_32F) for weight in weight_maps]
+    total = combine_weight_maps(weights)
+    weights = [cv2.divide(weight, total) for weight in weights]
+
+    fused = None
+    for image, weight in zip(images, weights):
+        gaussian = _gaussian_pyramid(_to_float(image), levels)
+        weight_pyramid = _gaussian_pyramid(cv2.cvtColor(weight, cv2.COLOR_GRAY2BGR), levels)
+        for level in range(levels):
+            band = gaussian[level]
+            if level < levels - 1:
+                band = cv2.subtract(
+                    band, cv2.pyrUp(gaussian[level + 1], dstsize=sizes[level])
+                )
+            band = cv2.multiply(band, weight_pyramid[level])
+            gaussian[level] = band if fused is None else cv2.add(fused[level], band)
+        fused = gaussian
+
+    result = fused[-1]
+    for level in range(levels - 2, -1, -1):
+        result = cv2.add(cv2.pyrUp(result, dstsize=sizes[level]), fused[level])
+    if depth == cv2.CV_32F:
+        return np.clip(result, 0, 1)
+    return cv2.add(result, 0, dtype=depth)
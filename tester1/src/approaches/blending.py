@@ -0,0 +1,177 @@
+import os
+from typing import List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from approaches.stages import max_value
+
+try:
+    import numexpr
+except ImportError:  # numexpr is optional
+    numexpr = None
+
+# Added to every weight so that pixels where all weights are 0 get the plain average
+EPSILON = 1e-6
+
+# "numpy" (in place), "opencv" (cv2.blendLinear, multithreaded) or "numexpr" (multithreaded)
+DEFAULT_METHOD = os.environ.get("UNDERWATER_FUSION_KERNEL", "numpy")
+
+
+def _check_shapes(images: Sequence[np.ndarray], weights: Sequence[np.ndarray]) -> None:
+    shapes = {image.shape[:2] for image in images} | {weight.shape[:2] for weight in weights}
+    if len(shapes) != 1:
+        raise ValueError("Images and weight maps must have the same spatial dimensions!")
+
+
+def fuse_weighted(
+    image1: np.ndarray,
+    image2: np.ndarray,
+    weight_map1: np.ndarray,
+    weight_map2: np.ndarray,
+    out: Optional[np.ndarray] = None,
+    scratch: Optional[np.ndarray] = None,
+    alpha: Optional[np.ndarray] = None,
+    method: Optional[str] = None,
+    eps: float = EPSILON,
+) -> np.ndarray:
+    """
+    Fuse two images with their weight maps, computing the weighted average
+    (image1 * w1 + image2 * w2) / (w1 + w2) as image2 + alpha * (image1 - image2) with
+    alpha = w1 / (w1 + w2). Everything is float32 and written into reusable buffers, so no
+    full-size float64 temporaries are created. 8-bit, 16-bit and float32 images keep their
+    dtype.
+
+    Args:
+        image1 (np.ndarray): The first image.
+        image2 (np.ndarray): The second image, of the same dtype.
+        weight_map1 (np.ndarray): The single-channel weight map of the first image.
+        weight_map2 (np.ndarray): The single-channel weight map of the second image.
+        out (Optional[np.ndarray]): Receives the fused image.
+        scratch (Optional[np.ndarray]): A float32 buffer with the shape of the images.
+        alpha (Optional[np.ndarray]): A float32 buffer with the shape of the weight maps.
+        method (Optional[str]): "numpy", "opencv" or "numexpr", defaults to the
+            UNDERWATER_FUSION_KERNEL environment variable. cv2.blendLinear has no 16-bit
+            version, so 16-bit images use numpy instead of "opencv".
+        eps (float): Added to both weights to handle pixels where both weights are 0.
+
+    Returns:
+        np.ndarray: The fused image.
+    """
+    _check_shapes([image1, image2], [weight_map1, weight_map2])
+    method = method or DEFAULT_METHOD
+    if out is None:
+        out = np.empty(image1.shape, dtype=image1.dtype)
+    if method == "opencv" and image1.dtype == np.uint16:
+        method = "numpy"
+
+    if alpha is None:
+        alpha = np.empty(weight_map1.shape[:2], dtype=np.float32)
+
+    # alpha = (w1 + eps) / (w1 + w2 + 2 * eps), with a single weight-sized temporary
+    np.add(weight_map1, eps, out=alpha, casting="unsafe")
+    denominator = np.add(weight_map2, eps, dtype=np.float32)
+    denominator += alpha
+    alpha /= denominator
+
+    if method == "opencv":
+        # blendLinear divides by w1 + w2 + 1e-5, which would swamp eps where both weights
+        # are 0, so it gets the normalized weights alpha and 1 - alpha, summing to 1
+        np.subtract(1.0, alpha, out=denominator)
+        return cv2.blendLinear(image1, image2, alpha, denominator, dst=out)
+
+    if scratch is None:
+        scratch = np.empty(image1.shape, dtype=np.float32)
+    weights = alpha[:, :, np.newaxis] if image1.ndim == 3 else alpha
+
+    if method == "numexpr":
+        if numexpr is None:
+            raise ValueError("The numexpr fusion kernel requires the numexpr package")
+        numexpr.evaluate(
+            "image2 + weights * (image1 - image2)",
+            local_dict={"image1": image1, "image2": image2, "weights": weights},
+            out=scratch,
+            casting="unsafe",
+        )
+    elif method == "numpy":
+        np.subtract(image1, image2, out=scratch, dtype=np.float32)
+        np.multiply(scratch, weights, out=scratch)
+        np.add(scratch, image2, out=scratch)
+    else:
+        raise ValueError(f"Unknown fusion kernel: {method}")
+
+    np.clip(scratch, 0, max_value(out.dtype), out=scratch)
+    np.copyto(out, scratch, casting="unsafe")
+    return out
+
+
+def gaussian_pyramid(image: np.ndarray, levels: int) -> List[np.ndarray]:
+    pyramid = [image]
+    for _ in range(levels - 1):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def laplacian_pyramid(image: np.ndarray, levels: int) -> List[np.ndarray]:
+    gaussian = gaussian_pyramid(image, levels)
+    pyramid = []
+    for level in range(levels - 1):
+        size = (gaussian[level].shape[1], gaussian[level].shape[0])
+        expanded = cv2.pyrUp(gaussian[level + 1], dstsize=size)
+        pyramid.append(cv2.subtract(gaussian[level], expanded))
+    pyramid.append(gaussian[-1])
+    return pyramid
+
+
+def fuse_pyramid(
+    images: Sequence[np.ndarray],
+    weight_maps: Sequence[np.ndarray],
+    levels: int = 5,
+    eps: float = EPSILON,
+) -> np.ndarray:
+    """
+    Multi-scale fusion: blend the Laplacian pyramids of the images with the Gaussian pyramids
+    of their normalized weight maps and collapse the result. This avoids the halos a single
+    scale weighted average produces around sharp weight transitions.
+
+    Args:
+        images (Sequence[np.ndarray]): The images to fuse, of one dtype.
+        weight_maps (Sequence[np.ndarray]): The single-channel weight map of each image.
+        levels (int): The number of pyramid levels, reduced for small images.
+        eps (float): Added to every weight to handle pixels where all weights are 0.
+
+    Returns:
+        np.ndarray: The fused image, in the dtype of the inputs.
+    """
+    _check_shapes(images, weight_maps)
+    height, width = images[0].shape[:2]
+    levels = max(1, min(levels, int(np.log2(max(1, min(height, width))))))
+
+    # Normalize the weights so that they sum to 1 at every pixel
+    weights = [weight.astype(np.float32) + eps for weight in weight_maps]
+    total = np.sum(weights, axis=0)
+    weights = [weight / total for weight in weights]
+
+    fused = None
+    for image, weight in zip(images, weights):
+        image_pyramid = laplacian_pyramid(image.astype(np.float32), levels)
+        weight_pyramid = gaussian_pyramid(weight, levels)
+        for level in range(levels):
+            level_weight = weight_pyramid[level]
+            if image_pyramid[level].ndim == 3:
+                level_weight = level_weight[:, :, np.newaxis]
+            image_pyramid[level] *= level_weight
+        if fused is None:
+            fused = image_pyramid
+        else:
+            for level in range(levels):
+                fused[level] += image_pyramid[level]
+
+    # Collapse the blended pyramid from the coarsest level up
+    result = fused[-1]
+    for level in range(levels - 2, -1, -1):
+        size = (fused[level].shape[1], fused[level].shape[0])
+        result = cv2.add(cv2.pyrUp(result, dstsize=size), fused[level])
+
+    dtype = images[0].dtype
+    return np.clip(result, 0, max_value(dtype)).astype(dtype)
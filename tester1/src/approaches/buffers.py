@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+BufferKey = Tuple[Tuple[int, ...], str]
+
+
+class BufferPool:
+    """
+    Scratch arrays kept between images so that consecutive images of the same size reuse
+    their memory instead of allocating (and page-faulting) fresh full-size arrays. Buffers
+    are lent out to one user at a time, so a pool can be shared by several threads. Idle
+    buffers of the least recently used shapes are released beyond the byte budget.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, max_per_shape: int = 4) -> None:
+        """
+        Initialize the pool
+
+        Args:
+            max_bytes (int): Budget of the idle buffers in bytes.
+            max_per_shape (int): Idle buffers kept per shape and dtype.
+        """
+        self.max_bytes = max_bytes
+        self.max_per_shape = max_per_shape
+        self._idle: "OrderedDict[BufferKey, List[np.ndarray]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def borrow(self, shape: Tuple[int, ...], dtype=np.float32) -> Iterator[np.ndarray]:
+        """
+        Lend an uninitialized buffer for the duration of a `with` block.
+
+        Args:
+            shape (Tuple[int, ...]): The shape of the buffer.
+            dtype: The dtype of the buffer.
+
+        Yields:
+            np.ndarray: A buffer nobody else is using until the block exits.
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        buffer = None
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                buffer = idle.pop()
+                self._bytes -= buffer.nbytes
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+        try:
+            yield buffer
+        finally:
+            self._release(key, buffer)
+
+    def _release(self, key: BufferKey, buffer: np.ndarray) -> None:
+        if buffer.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) >= self.max_per_shape:
+                return
+            idle.append(buffer)
+            self._bytes += buffer.nbytes
+
+            # Drop the idle buffers of the shapes used least recently
+            while self._bytes > self.max_bytes:
+                stale_key, stale = next(iter(self._idle.items()))
+                if not stale:
+                    del self._idle[stale_key]
+                    continue
+                self._bytes -= stale.pop(0).nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._idle.clear()
+            self._bytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
@@ -0,0 +1,787 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, fields, is_dataclass, replace
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from approaches import backends, blending, instrumentation, stages
+from approaches.buffers import BufferPool
+
+Stage = Callable[[np.ndarray], np.ndarray]
+Branch = Tuple[str, Stage]
+
+
+@dataclass(frozen=True)
+class FusionVariant:
+    """
+    A fusion approach described by its two pluggable stages. Both branches of the variant are
+    enhanced with luminance weight maps and fused into the final image, weighted by the sum of
+    the weight maps named in `weight_maps`. Weight maps are computed only when a fusion uses
+    them.
+
+    A stage is any callable. Stages with `tileable = True` also provide `statistics(image)`,
+    computing their global statistics, and `apply(image, statistics)`, so tiled execution can
+    compute the statistics once and apply them tile by tile.
+
+    Attributes:
+        white_balance (Stage): Maps a BGR image to its white-balanced BGR image.
+        enhance_contrast (Stage): Maps a grayscale image to its contrast-enhanced image.
+        fusion (str): "weighted" for the single-scale weighted average, or "pyramid" for
+            Laplacian pyramid (multi-scale) fusion.
+        levels (int): The number of pyramid levels of "pyramid" fusion.
+        weight_maps (Tuple[str, ...]): The maps weighting each branch in the fusion, among
+            "luminance", "saliency" and "chromatic".
+    """
+
+    white_balance: Stage
+    enhance_contrast: Stage
+    fusion: str = "weighted"
+    levels: int = 5
+    weight_maps: Tuple[str, ...] = ("luminance",)
+
+    def __post_init__(self) -> None:
+        if not self.weight_maps:
+            raise ValueError("A fusion needs at least one weight map")
+        for kind in self.weight_maps:
+            if kind not in stages.WEIGHT_MAPS:
+                raise ValueError(f"Unknown weight map: {kind}")
+
+
+APPROACHES: Dict[str, FusionVariant] = {
+    "approach1": FusionVariant(
+        white_balance=stages.GrayWorldWhiteBalance(),
+        enhance_contrast=stages.HistogramEqualization(),
+    ),
+    "approach2": FusionVariant(
+        white_balance=stages.PercentileWhiteBalance(),
+        enhance_contrast=stages.Clahe(),
+    ),
+}
+
+
+def with_weight_maps(
+    variants: Mapping[str, FusionVariant], weight_maps: Iterable[str]
+) -> Dict[str, FusionVariant]:
+    """
+    Return copies of the variants fusing with other weight maps.
+
+    Args:
+        variants (Mapping[str, FusionVariant]): The variants keyed by name.
+        weight_maps (Iterable[str]): The weight maps to fuse with.
+
+    Returns:
+        Dict[str, FusionVariant]: The updated variants.
+    """
+    weight_maps = tuple(weight_maps)
+    return {name: replace(variant, weight_maps=weight_maps) for name, variant in variants.items()}
+
+
+# Parameters of the variant itself rather than of its stages
+VARIANT_PARAMETERS = ("fusion", "levels", "weight_maps")
+
+
+def variant_parameters(variant: FusionVariant) -> Dict[str, Any]:
+    """
+    List the tunable parameters of a variant: the fields of its stages, such as
+    "percentile", "clip_limit" and "tile_grid", and the fusion settings.
+
+    Args:
+        variant (FusionVariant): The variant.
+
+    Returns:
+        Dict[str, Any]: The current value of each parameter.
+    """
+    parameters = {}
+    for stage in (variant.white_balance, variant.enhance_contrast):
+        if is_dataclass(stage):
+            parameters.update((field.name, getattr(stage, field.name)) for field in fields(stage))
+    parameters.update((name, getattr(variant, name)) for name in VARIANT_PARAMETERS)
+    return parameters
+
+
+def with_parameters(variant: FusionVariant, **parameters: Any) -> FusionVariant:
+    """
+    Return a copy of a variant with some parameters changed, e.g.
+    `with_parameters(APPROACHES["approach2"], clip_limit=3.0, percentile=98.5)`. Each
+    parameter is set on the stages that have it. Stages are frozen dataclasses compared by
+    value, so variants built this way share every stage whose parameters are equal, and with
+    it every intermediate of a FusionGraph.
+
+    Args:
+        variant (FusionVariant): The variant to start from.
+        **parameters: New values, keyed by names from `variant_parameters`.
+
+    Returns:
+        FusionVariant: The updated variant.
+
+    Raises:
+        ValueError: If the variant has no parameter of one of the names.
+    """
+    # Lists become tuples, so that the stages stay hashable
+    parameters = {
+        name: tuple(value) if isinstance(value, list) else value
+        for name, value in parameters.items()
+    }
+    unknown = set(parameters) - set(variant_parameters(variant))
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    changes = {name: parameters[name] for name in VARIANT_PARAMETERS if name in parameters}
+    for role in ("white_balance", "enhance_contrast"):
+        stage = getattr(variant, role)
+        if is_dataclass(stage):
+            own = {field.name for field in fields(stage)}
+            updates = {name: value for name, value in parameters.items() if name in own}
+            if updates:
+                changes[role] = replace(stage, **updates)
+    return replace(variant, **changes)
+
+
+def branches(variant: FusionVariant) -> Tuple[Branch, Branch]:
+    return (
+        ("enhance_contrast", variant.enhance_contrast),
+        ("white_balance", variant.white_balance),
+    )
+
+
+def node_name(key: Hashable) -> str:
+    """
+    Name a graph node for instrumentation, e.g. "gray", "white_balance.GrayWorldWhiteBalance"
+    or "enhanced.enhance_contrast.Clahe".
+    """
+    if isinstance(key, str):
+        return key
+    label, value = key
+    if isinstance(value, FusionVariant):
+        stages_used = (value.enhance_contrast, value.white_balance)
+        return f"{label}.{'+'.join(type(stage).__name__ for stage in stages_used)}"
+    if isinstance(value, tuple):
+        return f"{label}.{node_name(value)}"
+    return f"{label}.{type(value).__name__}"
+
+
+def pyramid_halo(levels: int) -> int:
+    """
+    The rows of context a strip needs above and below it for a pyramid fusion of `levels`
+    levels to match the full image. pyrDown's 5-tap filter reaches two rows of level k,
+    2 ** (k + 1) rows of the image, so the coarsest level sees less than 2 * 2 ** levels
+    rows either side, and collapsing the pyramid through pyrUp reaches as far again.
+    """
+    return 4 * 2 ** levels
+
+
+def halo_strips(
+    height: int, rows: int, halo: int, align: int = 1
+) -> Iterable[Tuple[int, int, int, int]]:
+    """
+    Split the rows of an image into strips of at most `rows` rows, each read with `halo`
+    rows of context above and below it.
+
+    Args:
+        height (int): The number of rows of the image.
+        rows (int): The maximum height of a strip, rounded down to a multiple of `align`.
+        halo (int): The rows of context, rounded up to a multiple of `align`.
+        align (int): Every row range starts on a multiple of this, so that the subsampling
+            of an image pyramid built from it lines up with the pyramid of the full image.
+
+    Returns:
+        Iterable[Tuple[int, int, int, int]]: The (top, bottom) rows to read and the
+            (start, stop) rows the strip produces, of each strip.
+    """
+    rows = max(align, rows // align * align)
+    halo = -(-halo // align) * align
+    for start in range(0, height, rows):
+        stop = min(start + rows, height)
+        yield max(0, start - halo), min(height, stop + halo), start, stop
+
+
+class FusionGraph:
+    """
+    The computation graph of one image. Every intermediate is a node keyed by the stages that
+    produce it and is computed at most once, so variants sharing a stage (or only the grayscale
+    conversion) reuse each other's work. Nodes may be requested from several threads; each
+    node is still computed only once.
+    """
+
+    def __init__(
+        self,
+        image: np.ndarray,
+        statistics: Optional[Mapping[Branch, object]] = None,
+        buffers: Optional[BufferPool] = None,
+        color_order: str = "bgr",
+        backend: Optional[str] = None,
+        frame_rows: Optional[int] = None,
+    ) -> None:
+        """
+        Initialize the graph with an image
+
+        Args:
+            image (numpy.ndarray): The input image expected in BGR format.
+            statistics (Optional[Mapping[Branch, object]]): Precomputed global statistics of
+                tileable stages, and saliency ranges keyed by ("saliency", branch), used
+                instead of statistics of `image` itself.
+            buffers (Optional[BufferPool]): Lends the scratch buffers of the fusion.
+            color_order (str): The channel order of `image`, "bgr" or "rgb". Every node is
+                computed in that order, so the fused images come out in it too.
+            backend (Optional[str]): Computes the weight maps, lightness weighting and
+                fusion: "numpy", "opencv" or "umat" (see backends.py), defaults to the
+                UNDERWATER_BACKEND environment variable.
+            frame_rows (Optional[int]): The height of each frame when `image` is a stack of
+                frames viewed as one tall image. Pyramid fusion then runs frame by frame, so
+                that its pyramids do not blend neighbouring frames.
+        """
+        if color_order not in stages.COLOR_ORDERS:
+            raise ValueError(f"Unknown color order: {color_order}")
+        self.image = image
+        self.color_order = color_order
+        self.backend = backends.check_backend(backend or backends.DEFAULT_BACKEND)
+        if self.backend == "umat" and (image.dtype != np.uint8 or frame_rows is not None):
+            # UMat planes carry no dtype and cannot be sliced into frames, so those images
+            # stay on arrays
+            self.backend = "opencv"
+        self.frame_rows = frame_rows
+        # Both modules provide WEIGHT_MAPS, combine_weight_maps and apply_luminance_map
+        self._ops = stages if self.backend == "numpy" else backends
+        self.statistics = dict(statistics or {})
+        self.buffers = buffers
+        self._nodes: Dict[Hashable, np.ndarray] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def node(self, key: Hashable, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """
+        Return the value of a node, computing it on first use.
+
+        Args:
+            key (Hashable): The identity of the node.
+            compute (Callable[[], np.ndarray]): Computes the node from its dependencies.
+
+        Returns:
+            np.ndarray: The memoized node value.
+        """
+        if key in self._nodes:
+            return self._nodes[key]
+
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._nodes:
+                if instrumentation.ENABLED:
+                    with instrumentation.stage(node_name(key)):
+                        self._nodes[key] = compute()
+                else:
+                    self._nodes[key] = compute()
+        return self._nodes[key]
+
+    def seed(self, key: Hashable, value: np.ndarray) -> None:
+        """
+        Provide the value of a node computed elsewhere, such as a slice of a full-image plane.
+
+        Args:
+            key (Hashable): The identity of the node.
+            value (np.ndarray): The node value.
+        """
+        self._nodes[key] = value
+
+    def discard(self, key: Hashable) -> None:
+        """
+        Drop a node no other node depends on, such as a fused image that has been consumed,
+        so that graphs running many variants do not keep every result.
+
+        Args:
+            key (Hashable): The identity of the node.
+        """
+        with self._lock:
+            self._nodes.pop(key, None)
+            self._locks.pop(key, None)
+
+    def bgr(self) -> np.ndarray:
+        return self.node("bgr", lambda: stages.to_bgr(self.image))
+
+    def gray(self) -> np.ndarray:
+        return self.node("gray", lambda: stages.to_gray(self.bgr(), self.color_order))
+
+    def branch(self, branch: Branch) -> np.ndarray:
+        """
+        Run a white balance stage on the BGR image or a contrast stage on the grayscale image.
+
+        Args:
+            branch (Branch): A ("white_balance" | "enhance_contrast", stage) pair.
+
+        Returns:
+            np.ndarray: The output of the stage.
+        """
+        kind, stage = branch
+
+        def compute() -> np.ndarray:
+            source = self.bgr() if kind == "white_balance" else self.gray()
+            if branch in self.statistics:
+                return stage.apply(source, self.statistics[branch])
+            return stage(source)
+
+        return self.node(branch, compute)
+
+    def branch_bgr(self, branch: Branch) -> np.ndarray:
+        def compute() -> np.ndarray:
+            image = self.branch(branch)
+            if image.ndim == 2:
+                return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            return image
+
+        return self.node(("bgr", branch), compute)
+
+    def source(self, branch: Branch) -> backends.Plane:
+        """
+        The image the weight maps and the lightness weighting of a branch are computed from:
+        the output of the branch, uploaded once as a 3-channel UMat by the "umat" backend.
+        """
+        if self.backend != "umat":
+            return self.branch(branch)
+        return self.node(("umat", branch), lambda: backends.upload(self.branch_bgr(branch)))
+
+    def weight_map(self, kind: str, branch: Branch) -> np.ndarray:
+        def compute() -> np.ndarray:
+            if (kind, branch) in self.statistics:
+                # The saliency range of the whole image this graph is a strip of
+                return self._ops.saliency_weight_map(
+                    self.source(branch), self.color_order, self.statistics[(kind, branch)]
+                )
+            return self._ops.WEIGHT_MAPS[kind](self.source(branch), self.color_order)
+
+        return self.node((kind, branch), compute)
+
+    def luminance_map(self, branch: Branch) -> np.ndarray:
+        return self.weight_map("luminance", branch)
+
+    def fusion_weight(self, weight_maps: Tuple[str, ...], branch: Branch) -> np.ndarray:
+        if len(weight_maps) == 1:
+            return self.weight_map(weight_maps[0], branch)
+        return self.node(
+            (f"weights.{'+'.join(weight_maps)}", branch),
+            lambda: self._ops.combine_weight_maps(
+                [self.weight_map(kind, branch) for kind in weight_maps]
+            ),
+        )
+
+    def enhanced(self, branch: Branch) -> np.ndarray:
+        def compute() -> np.ndarray:
+            image = self.source(branch) if self.backend == "umat" else self.branch_bgr(branch)
+            return self._ops.apply_luminance_map(
+                image, self.luminance_map(branch), self.color_order
+            )
+
+        return self.node(("enhanced", branch), compute)
+
+    def fused(self, variant: FusionVariant) -> np.ndarray:
+        """
+        Fuse the contrast-enhanced and white-balanced branches of a variant.
+
+        Args:
+            variant (FusionVariant): The variant to run.
+
+        Returns:
+            np.ndarray: The fused BGR image, in the dtype of the input.
+        """
+        contrast, balanced = branches(variant)
+
+        def compute() -> np.ndarray:
+            images = [self.enhanced(contrast), self.enhanced(balanced)]
+            weight_maps = [
+                self.fusion_weight(variant.weight_maps, contrast),
+                self.fusion_weight(variant.weight_maps, balanced),
+            ]
+            if variant.fusion == "pyramid":
+                return self._fuse_pyramid(images, weight_maps, variant.levels)
+            if self.backend != "numpy":
+                return backends.download(backends.fuse_weighted(*images, *weight_maps))
+            if self.buffers is None:
+                return blending.fuse_weighted(*images, *weight_maps)
+            with self.buffers.borrow(images[0].shape) as scratch:
+                with self.buffers.borrow(images[0].shape[:2]) as alpha:
+                    return blending.fuse_weighted(
+                        *images, *weight_maps, scratch=scratch, alpha=alpha
+                    )
+
+        return self.node(("fused", variant), compute)
+
+    def _fuse_pyramid(
+        self, images: List[backends.Plane], weight_maps: List[backends.Plane], levels: int
+    ) -> np.ndarray:
+        height, width = self.image.shape[:2]
+        rows = self.frame_rows or height
+        fused = []
+        for top in range(0, height, rows):
+            bottom = min(top + rows, height)
+            if rows < height:
+                frame_images = [image[top:bottom] for image in images]
+                frame_weights = [weight_map[top:bottom] for weight_map in weight_maps]
+            else:
+                frame_images, frame_weights = images, weight_maps
+            if self.backend == "numpy":
+                fused.append(blending.fuse_pyramid(frame_images, frame_weights, levels))
+            else:
+                size = (width, bottom - top)
+                frame = backends.fuse_pyramid(frame_images, frame_weights, size, levels)
+                fused.append(backends.download(frame))
+        return fused[0] if len(fused) == 1 else np.concatenate(fused)
+
+
+def run_variant(
+    image: np.ndarray,
+    variant: FusionVariant,
+    color_order: str = "bgr",
+    backend: Optional[str] = None,
+) -> np.ndarray:
+    """
+    Run a single variant on a graph of its own. This is the entry point used when variants
+    run in separate processes and cannot share a graph.
+
+    Args:
+        image (np.ndarray): The input image expected in BGR format.
+        variant (FusionVariant): The variant to run.
+        color_order (str): The channel order of `image`, "bgr" or "rgb".
+        backend (Optional[str]): The backend of the graph.
+
+    Returns:
+        np.ndarray: The fused BGR image, in the dtype of the input.
+    """
+    return FusionGraph(image, color_order=color_order, backend=backend).fused(variant)
+
+
+class FusionPipeline:
+    """
+    Runs several fusion variants over the same image, sharing intermediates between them.
+    The default variants reproduce `Approach1.process_image` and `Approach2.process_image`.
+
+    A pipeline is meant to be created once per worker and reused for every image: images are
+    arguments rather than state, the stages cache their OpenCV objects per thread and the
+    fusion scratch buffers are pooled by image shape. One instance can serve many threads.
+    """
+
+    def __init__(
+        self,
+        variants: Mapping[str, FusionVariant] = APPROACHES,
+        buffers: Optional[BufferPool] = None,
+        backend: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize the pipeline with the variants to run
+
+        Args:
+            variants (Mapping[str, FusionVariant]): The variants keyed by name.
+            buffers (Optional[BufferPool]): The scratch buffer pool, a new one by default.
+            backend (Optional[str]): "numpy", "opencv" or "umat", defaults to the
+                UNDERWATER_BACKEND environment variable. Strips and frame batches slice
+                their planes, so they run "umat" pipelines on the "opencv" backend.
+        """
+        self.variants = dict(variants)
+        self.buffers = buffers if buffers is not None else BufferPool()
+        self.backend = backends.check_backend(backend or backends.DEFAULT_BACKEND)
+
+    @classmethod
+    def from_env(cls) -> "FusionPipeline":
+        """
+        Build the pipeline of the default approaches, fusing with the weight maps listed in the
+        UNDERWATER_WEIGHT_MAPS environment variable (comma separated, "luminance" by default),
+        on the backend in UNDERWATER_BACKEND.
+
+        Returns:
+            FusionPipeline: The pipeline.
+        """
+        weight_maps = os.environ.get("UNDERWATER_WEIGHT_MAPS")
+        if not weight_maps:
+            return cls()
+        kinds = [kind.strip() for kind in weight_maps.split(",") if kind.strip()]
+        return cls(with_weight_maps(APPROACHES, kinds))
+
+    def fingerprint(self, name: str) -> str:
+        """
+        A stable digest of what the output of a variant depends on besides the image: its
+        parameters, the backend and the fusion kernel. Cached results are keyed by it, so a
+        configuration change never serves outputs of the old settings.
+
+        Args:
+            name (str): The variant.
+
+        Returns:
+            str: The hex digest.
+        """
+        settings = f"{self.variants[name]!r}|{self.backend}|{blending.DEFAULT_METHOD}"
+        return hashlib.blake2b(settings.encode(), digest_size=8).hexdigest()
+
+    def warm_up(self, shape: Tuple[int, int] = (64, 64)) -> None:
+        """
+        Run every variant once on a small synthetic image, so that OpenCV's lazy
+        initialization (color conversion tables, CPU dispatch, CLAHE objects) happens before
+        the first real image rather than during it.
+
+        Args:
+            shape (Tuple[int, int]): The (height, width) of the warm-up image.
+        """
+        rows, columns = np.mgrid[0 : shape[0], 0 : shape[1]]
+        image = np.dstack([rows, columns, rows + columns]) * 255 // max(1, sum(shape) - 2)
+        self.process(image.astype(np.uint8))
+
+    def process(
+        self,
+        image: np.ndarray,
+        executor: Optional[Executor] = None,
+        names: Optional[Iterable[str]] = None,
+        color_order: str = "bgr",
+    ) -> Dict[str, np.ndarray]:
+        """
+        Run the variants of the pipeline on an image, optionally in parallel.
+
+        The channel order is a contract for the whole call: an "rgb" image, such as a PIL or
+        tifffile array, is processed as it is with the RGB conversion codes of OpenCV, and
+        the fused images are returned in RGB as well. Nothing is swapped on the way in or
+        out.
+
+        Args:
+            image (np.ndarray): The input image expected in BGR format.
+            executor (Optional[Executor]): Runs the variants concurrently when given. Thread
+                pools share one graph; process pools give each variant its own graph.
+            names (Optional[Iterable[str]]): The variants to run, all of them when None.
+            color_order (str): The channel order of `image` and of the results, "bgr" or
+                "rgb".
+
+        Returns:
+            Dict[str, np.ndarray]: The fused image of each variant, keyed by variant name.
+        """
+        names = list(self.variants) if names is None else list(names)
+        results = dict(self.process_iter(image, executor, names, color_order))
+        return {name: results[name] for name in names}
+
+    def process_iter(
+        self,
+        image: np.ndarray,
+        executor: Optional[Executor] = None,
+        names: Optional[Iterable[str]] = None,
+        color_order: str = "bgr",
+    ) -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        Run the variants like `process`, yielding each fused image as soon as it is ready so
+        that it can be sent before the other variants finish.
+
+        Args:
+            image (np.ndarray): The input image expected in BGR format.
+            executor (Optional[Executor]): Runs the variants concurrently when given.
+            names (Optional[Iterable[str]]): The variants to run, all of them when None.
+            color_order (str): The channel order of `image` and of the results.
+
+        Yields:
+            Tuple[str, np.ndarray]: The name and fused image of each variant, in the order
+                the variants finish.
+        """
+        variants = self.variants
+        if names is not None:
+            variants = {name: self.variants[name] for name in names}
+        if not variants:
+            return
+
+        if executor is None:
+            graph = FusionGraph(image, None, self.buffers, color_order, self.backend)
+            for name, variant in variants.items():
+                yield name, graph.fused(variant)
+            return
+
+        if isinstance(executor, ProcessPoolExecutor) or getattr(
+            executor, "uses_processes", False
+        ):
+            futures = {
+                executor.submit(run_variant, image, variant, color_order, self.backend): name
+                for name, variant in variants.items()
+            }
+        else:
+            # Compute the intermediates every variant needs before fanning out
+            graph = FusionGraph(image, None, self.buffers, color_order, self.backend)
+            graph.gray()
+            futures = {
+                executor.submit(graph.fused, variant): name
+                for name, variant in variants.items()
+            }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def process_tiled(
+        self,
+        image: np.ndarray,
+        tile_rows: int = 512,
+        overlap: int = 16,
+        names: Optional[Iterable[str]] = None,
+        outputs: Optional[Mapping[str, np.ndarray]] = None,
+        color_order: str = "bgr",
+    ) -> Dict[str, np.ndarray]:
+        """
+        Run the variants strip by strip so that peak memory depends on the strip size rather
+        than the image size. Global statistics (gray-world averages, percentiles, histogram
+        equalization tables) are computed once over the whole image first, reading it a
+        chunk at a time. Two single-channel planes stay full-frame: the grayscale plane and
+        the output of stages that cannot be tiled, such as CLAHE, which runs on the whole
+        plane. Saliency maps are normalized by the range of the whole image, which a first
+        pass over the strips finds. Each strip is converted to BGR on its own and computed
+        with `overlap` rows of context above and below it, at least `pyramid_halo` rows for
+        pyramid variants and aligned to their coarsest level, and only its own rows are
+        kept, so the results match `process`.
+
+        The image is only read strip by strip, so it can be a memory-mapped 8-bit, 16-bit or
+        float32 file, and the results can be written straight into memory-mapped
+        destinations passed as `outputs`.
+
+        Args:
+            image (np.ndarray): The input image expected in BGR format.
+            tile_rows (int): The height of a strip in rows.
+            overlap (int): The minimum rows of context read above and below each strip.
+            names (Optional[Iterable[str]]): The variants to run, all of them when None.
+            outputs (Optional[Mapping[str, np.ndarray]]): Preallocated destinations with the
+                shape and dtype of the BGR image, keyed by variant name. Variants without
+                one get a new array.
+            color_order (str): The channel order of `image` and of the results, "bgr" or
+                "rgb". RGB files are read and written in place without reordering.
+
+        Returns:
+            Dict[str, np.ndarray]: The fused image of each variant, keyed by variant name.
+        """
+        variants = self.variants
+        if names is not None:
+            variants = {name: self.variants[name] for name in names}
+
+        # The grayscale plane is converted strip by strip, and the white balance statistics
+        # read a BGR view, so that the image is never copied whole
+        backend = "opencv" if self.backend == "umat" else self.backend
+        height = image.shape[0]
+        shape = (height, image.shape[1], 3)
+        gray = np.empty(shape[:2], dtype=image.dtype)
+        for top, bottom, _, _ in halo_strips(height, tile_rows, 0):
+            gray[top:bottom] = stages.to_gray(stages.to_bgr(image[top:bottom]), color_order)
+        full = FusionGraph(image, color_order=color_order, backend=backend)
+        full.seed("gray", gray)
+        statistics = {}
+        planes = {}
+        salient = set()
+        for variant in variants.values():
+            for branch in branches(variant):
+                kind, stage = branch
+                if getattr(stage, "tileable", False):
+                    source = stages.bgr_view(image) if kind == "white_balance" else gray
+                    statistics[branch] = stage.statistics(source)
+                else:
+                    planes[branch] = full.branch(branch)
+                if "saliency" in variant.weight_maps:
+                    salient.add(branch)
+
+        destinations = outputs or {}
+        outputs = {}
+        for name in variants:
+            output = destinations.get(name)
+            if output is None:
+                output = np.empty(shape, dtype=image.dtype)
+            elif output.shape != shape or output.dtype != image.dtype:
+                raise ValueError(f"The output of {name} must be a {image.dtype} {shape} array")
+            outputs[name] = output
+        # Pyramid filters reach across rows, so their strips need more context, and the
+        # Laplacian of the saliency maps needs one row
+        levels = max(
+            (variant.levels for variant in variants.values() if variant.fusion == "pyramid"),
+            default=0,
+        )
+        halo = max(overlap, pyramid_halo(levels)) if levels else overlap
+        if salient:
+            halo = max(halo, 1)
+        align = 2 ** (levels - 1) if levels else 1
+        strips = list(halo_strips(height, tile_rows, halo, align))
+
+        def strip_graph(top: int, bottom: int) -> FusionGraph:
+            strip = stages.to_bgr(image[top:bottom])
+            graph = FusionGraph(strip, statistics, self.buffers, color_order, backend)
+            graph.seed("gray", gray[top:bottom])
+            for branch, plane in planes.items():
+                graph.seed(branch, plane[top:bottom])
+            return graph
+
+        if salient:
+            ranges = {branch: (np.inf, -np.inf) for branch in salient}
+            for top, bottom, start, stop in strips:
+                graph = strip_graph(top, bottom)
+                for branch, (low, high) in ranges.items():
+                    magnitude = stages.laplacian_magnitude(graph.branch(branch), color_order)
+                    strip_low, strip_high = cv2.minMaxLoc(magnitude[start - top : stop - top])[:2]
+                    ranges[branch] = (min(low, strip_low), max(high, strip_high))
+            statistics.update({("saliency", branch): value for branch, value in ranges.items()})
+
+        for top, bottom, start, stop in strips:
+            graph = strip_graph(top, bottom)
+            for name, variant in variants.items():
+                fused = graph.fused(variant)
+                outputs[name][start:stop] = fused[start - top : stop - top]
+
+        return outputs
+
+    def process_batch(
+        self,
+        images: np.ndarray,
+        names: Optional[Iterable[str]] = None,
+        frames_per_chunk: int = 8,
+        color_order: str = "bgr",
+    ) -> Dict[str, np.ndarray]:
+        """
+        Run the variants on a stack of same-sized images. The frames of a chunk are viewed
+        as one tall image, so the color conversions, weight maps, LAB weighting and weighted
+        fusion each run as a single call over the whole chunk. The stages whose statistics
+        belong to a single frame (white balance, equalization, CLAHE, saliency) and pyramid
+        fusion, whose filters reach across rows, run frame by frame, so every frame comes
+        out exactly as `process` would produce it. Results are written into one preallocated
+        stack per variant.
+
+        Args:
+            images (np.ndarray): The BGR images, of shape (frames, height, width, 3).
+            names (Optional[Iterable[str]]): The variants to run, all of them when None.
+            frames_per_chunk (int): Frames processed together, which bounds the memory of
+                the intermediates.
+            color_order (str): The channel order of `images` and of the results.
+
+        Returns:
+            Dict[str, np.ndarray]: The fused stack of each variant, keyed by variant name.
+        """
+        if images.ndim != 4 or images.shape[3] != 3:
+            raise ValueError("Expected a stack of BGR images of shape (frames, height, width, 3)")
+        variants = self.variants
+        if names is not None:
+            variants = {name: self.variants[name] for name in names}
+        outputs = {name: np.empty(images.shape, dtype=images.dtype) for name in variants}
+        backend = "opencv" if self.backend == "umat" else self.backend
+
+        count, height = images.shape[:2]
+        for start in range(0, count, max(1, frames_per_chunk)):
+            chunk = np.ascontiguousarray(images[start : start + frames_per_chunk])
+            frames = len(chunk)
+            tall = chunk.reshape(frames * height, *chunk.shape[2:])
+            graph = FusionGraph(tall, None, self.buffers, color_order, backend, height)
+            gray = graph.gray()
+
+            # Stages with per-frame statistics, seeded into the graph of the tall image
+            for variant in variants.values():
+                for branch in branches(variant):
+                    kind, stage = branch
+                    source = graph.bgr() if kind == "white_balance" else gray
+                    source = source.reshape(frames, height, *source.shape[1:])
+                    result = np.empty_like(source)
+                    for index in range(frames):
+                        result[index] = stage(source[index])
+                    graph.seed(branch, result.reshape(frames * height, *result.shape[2:]))
+
+                    # Saliency is normalized by the range of its own frame
+                    if "saliency" in variant.weight_maps:
+                        saliency = np.stack(
+                            [stages.saliency_weight_map(frame, color_order) for frame in result]
+                        )
+                        graph.seed(("saliency", branch), saliency.reshape(frames * height, -1))
+
+            for name, variant in variants.items():
+                fused = graph.fused(variant)
+                outputs[name][start : start + frames] = fused.reshape(chunk.shape)
+
+        return outputs
@@ -0,0 +1,204 @@
+"""
+Wall time, CPU time and peak allocation of the enhancement stages.
+
+Recording is off unless UNDERWATER_METRICS=1. When it is off, `stage` returns a shared no-op
+context manager and `instrumented` functions call straight through, so the only cost left is
+one global lookup per stage. UNDERWATER_TRACE_MEMORY=1 additionally traces allocations with
+tracemalloc, which slows everything down noticeably and is meant for investigations only.
+"""
+import contextvars
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional
+
+ENABLED = os.environ.get("UNDERWATER_METRICS", "0") == "1"
+TRACE_MEMORY = False
+
+_DISABLED = nullcontext()
+
+# Stage totals of the current request, in milliseconds, for the Server-Timing header
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+_request_lock = threading.Lock()
+
+# Per-thread stack of the allocation peaks of nested stages
+_frames = threading.local()
+
+
+class StageMetrics:
+    """Totals of every stage since the process started."""
+
+    def __init__(self) -> None:
+        self._stages: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, wall: float, cpu: float, peak: Optional[int]) -> None:
+        with self._lock:
+            totals = self._stages.setdefault(name, [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+            if peak is not None:
+                totals[3] = max(totals[3], peak)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {"count": count, "seconds": wall, "cpu_seconds": cpu, "peak_bytes": peak}
+                for name, (count, wall, cpu, peak) in self._stages.items()
+            }
+
+    def render(self) -> str:
+        """
+        Format the totals in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics page.
+        """
+        stages = self.snapshot()
+        lines = [
+            "# HELP underwater_stage_seconds Wall time spent in each stage.",
+            "# TYPE underwater_stage_seconds summary",
+        ]
+        for name, totals in stages.items():
+            lines.append(f'underwater_stage_seconds_sum{{stage="{name}"}} {totals["seconds"]}')
+            lines.append(f'underwater_stage_seconds_count{{stage="{name}"}} {totals["count"]}')
+        lines += [
+            "# HELP underwater_stage_cpu_seconds_total CPU time of the thread running each stage.",
+            "# TYPE underwater_stage_cpu_seconds_total counter",
+        ]
+        for name, totals in stages.items():
+            lines.append(
+                f'underwater_stage_cpu_seconds_total{{stage="{name}"}} {totals["cpu_seconds"]}'
+            )
+        if TRACE_MEMORY:
+            lines += [
+                "# HELP underwater_stage_peak_bytes Largest allocation peak of each stage.",
+                "# TYPE underwater_stage_peak_bytes gauge",
+            ]
+            for name, totals in stages.items():
+                peak = totals["peak_bytes"]
+                lines.append(f'underwater_stage_peak_bytes{{stage="{name}"}} {peak}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = StageMetrics()
+
+
+def enable(trace_memory: bool = False) -> None:
+    """
+    Turn recording on at runtime.
+
+    Args:
+        trace_memory (bool): Also record the allocation peak of every stage.
+    """
+    global ENABLED, TRACE_MEMORY
+    ENABLED = True
+    TRACE_MEMORY = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable() -> None:
+    global ENABLED, TRACE_MEMORY
+    ENABLED = False
+    TRACE_MEMORY = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+@contextmanager
+def _measure(name: str) -> Iterator[None]:
+    peak = None
+    stack = None
+    if TRACE_MEMORY and tracemalloc.is_tracing():
+        # The tracemalloc peak is global: fold it into the enclosing stage before resetting
+        stack = getattr(_frames, "stack", None)
+        if stack is None:
+            stack = _frames.stack = []
+        current, previous_peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], previous_peak)
+        stack.append([current, 0])
+        tracemalloc.reset_peak()
+
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        cpu = time.thread_time() - cpu
+        wall = time.perf_counter() - wall
+        if stack is not None:
+            start, nested_peak = stack.pop()
+            highest = max(tracemalloc.get_traced_memory()[1], nested_peak)
+            if stack:
+                stack[-1][1] = max(stack[-1][1], highest)
+            peak = max(0, highest - start)
+
+        metrics.record(name, wall, cpu, peak)
+        timings = _request_timings.get()
+        if timings is not None:
+            with _request_lock:
+                timings[name] = timings.get(name, 0.0) + wall * 1000
+
+
+def stage(name: str) -> ContextManager[None]:
+    """
+    Measure the block of a `with` statement as the stage `name`.
+
+    Args:
+        name (str): The stage name, such as "decode" or "approach1.white_balance".
+
+    Returns:
+        ContextManager[None]: The measuring context, or a no-op when recording is off.
+    """
+    if not ENABLED:
+        return _DISABLED
+    return _measure(name)
+
+
+def instrumented(name: str) -> Callable[[Callable], Callable]:
+    """Decorate a function so that every call is measured as the stage `name`."""
+
+    def decorate(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _measure(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def start_request() -> None:
+    """Start collecting the stage totals of the request handled by the current context."""
+    if ENABLED:
+        _request_timings.set({})
+
+
+def server_timing() -> Optional[str]:
+    """
+    Format the stage totals of the current request as a Server-Timing header value.
+
+    Returns:
+        Optional[str]: The header value, or None when nothing was recorded.
+    """
+    timings = _request_timings.get()
+    if not timings:
+        return None
+    with _request_lock:
+        items = list(timings.items())
+    return ", ".join(f"{name};dur={duration:.2f}" for name, duration in items)
+
+
+if ENABLED and os.environ.get("UNDERWATER_TRACE_MEMORY", "0") == "1":
+    enable(trace_memory=True)
@@ -0,0 +1,115 @@
+"""
+No-reference quality metrics for underwater images.
+
+UCIQE (Yang and Sowmya, 2015) combines the spread of chroma, the contrast of luminance and the
+average saturation in CIELAB. UIQM (Panetta, Gao and Agaian, 2016) combines colorfulness,
+sharpness and contrast measures. Higher is better for both. They are meant for comparing
+enhancements of the same photo rather than as absolute scores, and are cheap enough to run on
+downsampled images.
+"""
+from typing import Callable, Dict
+
+import cv2
+import numpy as np
+
+from approaches.stages import max_value
+
+
+def _lab(image: np.ndarray) -> np.ndarray:
+    # float32 conversion: L in [0, 100], a and b centered on 0, for any input depth
+    scaled = image.astype(np.float32) / np.float32(max_value(image.dtype))
+    return cv2.cvtColor(scaled, cv2.COLOR_BGR2LAB)
+
+
+def _blocks(plane: np.ndarray, size: int) -> np.ndarray:
+    """View a plane as (rows, columns, size * size) blocks, dropping the partial ones."""
+    rows, columns = plane.shape[0] // size, plane.shape[1] // size
+    if rows == 0 or columns == 0:
+        raise ValueError(f"The image is smaller than the {size}x{size} metric blocks")
+    blocks = plane[: rows * size, : columns * size].reshape(rows, size, columns, size)
+    return blocks.transpose(0, 2, 1, 3).reshape(rows, columns, size * size)
+
+
+def uciqe(image: np.ndarray) -> float:
+    """
+    Underwater color image quality evaluation: 0.4680 * chroma standard deviation
+    + 0.2745 * luminance contrast + 0.2576 * mean saturation, with luminance and chroma
+    normalized to [0, 1].
+
+    Args:
+        image (np.ndarray): A BGR image.
+
+    Returns:
+        float: The UCIQE score.
+    """
+    lab = _lab(image)
+    lightness = lab[:, :, 0].ravel() / 100.0
+    chroma = np.hypot(lab[:, :, 1], lab[:, :, 2]).ravel() / 100.0
+
+    # Contrast between the brightest and the darkest 1% of the pixels
+    count = max(1, int(round(0.01 * lightness.size)))
+    ordered = np.partition(lightness, (count - 1, lightness.size - count))
+    contrast = ordered[-count:].mean() - ordered[:count].mean()
+
+    lit = lightness > 0
+    saturation = np.zeros_like(chroma)
+    saturation[lit] = chroma[lit] / lightness[lit]
+    return float(0.4680 * chroma.std() + 0.2745 * contrast + 0.2576 * saturation.mean())
+
+
+def _trimmed_mean_variance(values: np.ndarray, trim: float = 0.1):
+    ordered = np.sort(values.ravel())
+    cut = int(np.ceil(trim * ordered.size))
+    mean = ordered[cut : ordered.size - cut].mean() if ordered.size > 2 * cut else ordered.mean()
+    return mean, np.mean((ordered - mean) ** 2)
+
+
+def _eme(plane: np.ndarray, size: int) -> float:
+    # Enhancement measure: mean of log(max / min) over the blocks, skipping empty ones
+    blocks = _blocks(plane, size)
+    high, low = blocks.max(axis=2), blocks.min(axis=2)
+    valid = (low > 0) & (high > 0)
+    return 2.0 / high.size * float(np.log(high[valid] / low[valid]).sum())
+
+
+def _amee(plane: np.ndarray, size: int) -> float:
+    # Logarithmic Michelson contrast of the blocks (alpha = 1)
+    blocks = _blocks(plane, size)
+    high, low = blocks.max(axis=2), blocks.min(axis=2)
+    spread, total = high - low, high + low
+    valid = (spread > 0) & (total > 0)
+    ratio = spread[valid] / total[valid]
+    return -1.0 / high.size * float((ratio * np.log(ratio)).sum())
+
+
+def uiqm(image: np.ndarray, block: int = 8) -> float:
+    """
+    Underwater image quality measure: 0.0282 * UICM (colorfulness) + 0.2953 * UISM
+    (sharpness) + 3.5753 * UIConM (contrast), on the 8-bit intensity scale.
+
+    Args:
+        image (np.ndarray): A BGR image.
+        block (int): The size of the square blocks of the sharpness and contrast measures.
+
+    Returns:
+        float: The UIQM score.
+    """
+    scaled = image.astype(np.float64) * (255.0 / max_value(image.dtype))
+    blue, green, red = scaled[:, :, 0], scaled[:, :, 1], scaled[:, :, 2]
+
+    # Colorfulness from the alpha-trimmed statistics of the opponent channels
+    mean_rg, variance_rg = _trimmed_mean_variance(red - green)
+    mean_yb, variance_yb = _trimmed_mean_variance((red + green) / 2 - blue)
+    uicm = -0.0268 * np.hypot(mean_rg, mean_yb) + 0.1586 * np.sqrt(variance_rg + variance_yb)
+
+    # Sharpness from the Sobel edges of each channel, weighted like luma
+    uism = 0.0
+    for plane, weight in ((red, 0.299), (green, 0.587), (blue, 0.114)):
+        edges = np.hypot(cv2.Sobel(plane, cv2.CV_64F, 1, 0), cv2.Sobel(plane, cv2.CV_64F, 0, 1))
+        uism += weight * _eme(edges * plane, block)
+
+    uiconm = _amee(cv2.cvtColor(scaled.astype(np.float32), cv2.COLOR_BGR2GRAY), block)
+    return float(0.0282 * uicm + 0.2953 * uism + 3.5753 * uiconm)
+
+
+METRICS: Dict[str, Callable[[np.ndarray], float]] = {"uciqe": uciqe, "uiqm": uiqm}
@@ -0,0 +1,133 @@
+"""
+Automatic choice between the approaches.
+
+Running every approach at full resolution and letting the user pick doubles the work for
+automated pipelines. The selector instead runs all of them on a thumbnail, scores the
+thumbnails with a no-reference quality metric and predicts that the best scoring approach
+also wins at full resolution, so only that one has to run on the full image. Cheap statistics
+of the thumbnail (channel balance, histogram spread, contrast) are reported with every
+decision so that the choices can be audited; they are informational only and do not take
+part in the choice, which compares the scores alone.
+"""
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from approaches import instrumentation
+from approaches.fusion import FusionPipeline
+from approaches.quality import METRICS
+from approaches.stages import downscale, max_value, to_bgr, to_gray
+
+
+def image_statistics(bgr: np.ndarray) -> Dict[str, float]:
+    """
+    Cheap global statistics of an image that describe its color cast and contrast.
+
+    Args:
+        bgr (np.ndarray): A BGR image, usually a thumbnail.
+
+    Returns:
+        Dict[str, float]: The red/green and blue/green mean ratios, the spread between the
+            1st and 99th gray percentiles and the RMS contrast, both relative to white.
+    """
+    white = max_value(bgr.dtype)
+    blue, green, red = (float(mean) for mean in cv2.mean(bgr)[:3])
+    gray = to_gray(bgr)
+    low, high = np.percentile(gray, (1, 99))
+    green = max(green, 1e-6)
+    return {
+        "red_green_ratio": round(red / green, 4),
+        "blue_green_ratio": round(blue / green, 4),
+        "histogram_spread": round(float(high - low) / white, 4),
+        "contrast": round(float(gray.std()) / white, 4),
+    }
+
+
+@dataclass(frozen=True)
+class Selection:
+    """
+    The approach chosen for an image, with the scores behind the choice and the
+    informational statistics of the thumbnail.
+    """
+
+    approach: str
+    metric: str
+    scores: Dict[str, float]
+    statistics: Dict[str, float]
+    size: Tuple[int, int]
+
+    def report(self) -> dict:
+        return {
+            "approach": self.approach,
+            "metric": self.metric,
+            "scores": self.scores,
+            # Reported for audits only; the choice depends on the scores alone
+            "informational_statistics": self.statistics,
+            "thumbnail": {"width": self.size[0], "height": self.size[1]},
+        }
+
+
+class ApproachSelector:
+    """
+    Picks the approach expected to score best on a no-reference metric, by running the
+    variants of a pipeline on a thumbnail of the image.
+    """
+
+    def __init__(
+        self, pipeline: FusionPipeline, metric: str = "uciqe", max_size: int = 256
+    ) -> None:
+        """
+        Initialize the selector
+
+        Args:
+            pipeline (FusionPipeline): The pipeline whose variants are compared.
+            metric (str): "uciqe" or "uiqm".
+            max_size (int): The longer side of the thumbnail the variants are scored on.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown quality metric: {metric}")
+        if max_size < 16:
+            raise ValueError("The selection thumbnail must be at least 16 pixels")
+        self.pipeline = pipeline
+        self.metric = metric
+        self.max_size = max_size
+
+    @classmethod
+    def from_env(cls, pipeline: FusionPipeline) -> "ApproachSelector":
+        """
+        Create a selector configured by UNDERWATER_QUALITY_METRIC (uciqe by default) and
+        UNDERWATER_SELECTION_SIZE (256 by default).
+        """
+        return cls(
+            pipeline,
+            os.environ.get("UNDERWATER_QUALITY_METRIC", "uciqe"),
+            int(os.environ.get("UNDERWATER_SELECTION_SIZE", 256)),
+        )
+
+    def select(self, image: np.ndarray, names: Optional[Iterable[str]] = None) -> Selection:
+        """
+        Choose the approach to run on an image.
+
+        Args:
+            image (np.ndarray): The input image expected in BGR format.
+            names (Optional[Iterable[str]]): The candidate variants, all of them when None.
+
+        Returns:
+            Selection: The variant with the best score, the metric score of every candidate
+                on the thumbnail and the informational statistics of the thumbnail.
+        """
+        with instrumentation.stage("select"):
+            small = to_bgr(downscale(image, self.max_size))
+            results = self.pipeline.process(small, names=names)
+            score = METRICS[self.metric]
+            scores = {name: round(score(result), 4) for name, result in results.items()}
+            return Selection(
+                approach=max(scores, key=scores.get),
+                metric=self.metric,
+                scores=scores,
+                statistics=image_statistics(small),
+                size=(small.shape[1], small.shape[0]),
+            )
@@ -0,0 +1,667 @@
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Mapping, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# The channel orders the stages accept. Images are processed in their own order, with the
+# OpenCV conversion codes of that order, so RGB input is never swapped to BGR and back.
+COLOR_ORDERS = ("bgr", "rgb")
+_CONVERSIONS = {
+    "bgr": {
+        "gray": cv2.COLOR_BGR2GRAY,
+        "yuv": cv2.COLOR_BGR2YUV,
+        "hsv": cv2.COLOR_BGR2HSV,
+        "lab": cv2.COLOR_BGR2LAB,
+        "from_lab": cv2.COLOR_LAB2BGR,
+    },
+    "rgb": {
+        "gray": cv2.COLOR_RGB2GRAY,
+        "yuv": cv2.COLOR_RGB2YUV,
+        "hsv": cv2.COLOR_RGB2HSV,
+        "lab": cv2.COLOR_RGB2LAB,
+        "from_lab": cv2.COLOR_LAB2RGB,
+    },
+}
+
+
+def conversion(color_order: str, target: str) -> int:
+    """
+    Look up the OpenCV code converting images of a channel order.
+
+    Args:
+        color_order (str): "bgr" or "rgb".
+        target (str): "gray", "yuv", "hsv", "lab", or "from_lab" for the way back from LAB.
+
+    Returns:
+        int: The cv2.COLOR_* code.
+    """
+    if color_order not in _CONVERSIONS:
+        raise ValueError(f"Unknown color order: {color_order}")
+    return _CONVERSIONS[color_order][target]
+
+
+def reorder(image: np.ndarray, color_order: str, target: str) -> np.ndarray:
+    """
+    View a color image in another channel order. The view reverses the channel axis without
+    copying; OpenCV copies it into its own order only when it is handed to a function.
+
+    Args:
+        image (np.ndarray): A grayscale or 3-channel image in `color_order`.
+        color_order (str): The channel order of `image`, "bgr" or "rgb".
+        target (str): The channel order wanted.
+
+    Returns:
+        np.ndarray: `image` itself, or a reversed view of it.
+    """
+    for order in (color_order, target):
+        if order not in COLOR_ORDERS:
+            raise ValueError(f"Unknown color order: {order}")
+    if color_order == target or image.ndim == 2:
+        return image
+    return image[:, :, ::-1]
+
+
+def to_bgr(image: np.ndarray) -> np.ndarray:
+    """
+    Normalize an input image to a 3-channel BGR image. BGRA images drop their alpha channel
+    and grayscale images are expanded to three identical channels. Neither conversion moves
+    the color channels, so RGB and RGBA images come out as RGB.
+
+    Args:
+        image (np.ndarray): The input image in grayscale, BGR or BGRA format.
+
+    Returns:
+        np.ndarray: The image as a 3-channel BGR array.
+    """
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+def bgr_view(image: np.ndarray) -> np.ndarray:
+    """
+    Return the 3-channel image `to_bgr` would produce as a view of `image`, without copying
+    it: grayscale images are broadcast to three channels and BGRA images lose their alpha
+    channel. Statistics read it a row chunk at a time, so large images stay on disk.
+
+    Args:
+        image (np.ndarray): The input image in grayscale, BGR or BGRA format.
+
+    Returns:
+        np.ndarray: A read-only view with the values of `to_bgr(image)`.
+    """
+    if image.ndim == 2:
+        return np.broadcast_to(image[:, :, np.newaxis], (*image.shape, 3))
+    return image[:, :, :3]
+
+
+def to_gray(image: np.ndarray, color_order: str = "bgr") -> np.ndarray:
+    """
+    Convert a BGR image to grayscale.
+
+    Args:
+        image (np.ndarray): An input image in BGR format.
+        color_order (str): The channel order of `image`, "bgr" or "rgb".
+
+    Returns:
+        np.ndarray: The single-channel grayscale image.
+    """
+    return cv2.cvtColor(image, conversion(color_order, "gray"))
+
+
+def downscale(image: np.ndarray, max_size: int) -> np.ndarray:
+    """
+    Shrink an image so that its longer side is at most `max_size` pixels. Area interpolation
+    averages the source pixels, which avoids the aliasing of nearest or linear sampling.
+
+    Args:
+        image (np.ndarray): The image to shrink.
+        max_size (int): The maximum length of the longer side.
+
+    Returns:
+        np.ndarray: The shrunk image, or the image itself if it is already small enough.
+    """
+    if max_size <= 0:
+        raise ValueError("The maximum size must be positive")
+    height, width = image.shape[:2]
+    scale = max_size / max(height, width)
+    if scale >= 1:
+        return image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+# Per-thread CLAHE objects, keyed by Clahe stage
+_clahe_objects = threading.local()
+
+
+def max_value(dtype: np.dtype) -> float:
+    """
+    Return the white level of an image dtype: the largest value of integer types and 1.0
+    for floating point images.
+
+    Args:
+        dtype (np.dtype): The image dtype.
+
+    Returns:
+        float: The white level.
+    """
+    if np.issubdtype(dtype, np.integer):
+        return float(np.iinfo(dtype).max)
+    return 1.0
+
+
+def levels(dtype: np.dtype) -> int:
+    """
+    Return the number of intensity levels of an integer image dtype.
+
+    Args:
+        dtype (np.dtype): np.uint8 or np.uint16.
+
+    Returns:
+        int: 256 or 65536.
+    """
+    if dtype == np.uint8:
+        return 256
+    if dtype == np.uint16:
+        return 65536
+    raise ValueError(f"Histograms need 8 or 16-bit images, not {dtype}")
+
+
+def to_uint16(plane: np.ndarray) -> np.ndarray:
+    """Quantize a floating point plane in [0, 1] to 16 bits for histogram based stages."""
+    return np.clip(np.rint(plane * 65535.0), 0, 65535).astype(np.uint16)
+
+
+def from_uint16(plane: np.ndarray) -> np.ndarray:
+    return plane.astype(np.float32) / np.float32(65535.0)
+
+
+def row_chunks(image: np.ndarray, pixels: int = 1 << 22) -> Iterator[np.ndarray]:
+    """
+    Split an image into contiguous chunks of whole rows of about `pixels` pixels, so that
+    memory-mapped images are read a piece at a time.
+
+    Args:
+        image (np.ndarray): The image.
+        pixels (int): The approximate number of pixels of a chunk.
+
+    Yields:
+        np.ndarray: The chunks, from the top of the image down.
+    """
+    chunk_rows = max(1, pixels // max(1, image.shape[1]))
+    for top in range(0, image.shape[0], chunk_rows):
+        yield np.ascontiguousarray(image[top : top + chunk_rows])
+
+
+def histograms(image: np.ndarray) -> np.ndarray:
+    """
+    Compute the histogram of every channel of an 8-bit (256 bins) or 16-bit (65536 bins)
+    image; floating point images are quantized to 16 bits. OpenCV counts in float32, which
+    is exact only up to 2**24, so the rows are counted in chunks and summed as integers.
+
+    Args:
+        image (np.ndarray): A grayscale or multi-channel image.
+
+    Returns:
+        np.ndarray: An int64 array of shape (channels, bins).
+    """
+    floating = image.dtype not in (np.uint8, np.uint16)
+    bins = 65536 if floating else levels(image.dtype)
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    counts = np.zeros((channels, bins), dtype=np.int64)
+    for chunk in row_chunks(image):
+        if floating:
+            chunk = to_uint16(chunk)
+        for channel in range(channels):
+            hist = cv2.calcHist([chunk], [channel], None, [bins], [0, bins])
+            counts[channel] += hist.ravel().astype(np.int64)
+    return counts
+
+
+def histogram_percentile(hist: np.ndarray, percentile: float) -> float:
+    """
+    Compute a percentile of the values counted in a histogram, with the same linear
+    interpolation between neighbouring order statistics as `np.percentile`.
+
+    Args:
+        hist (np.ndarray): The histogram of one channel.
+        percentile (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile value.
+    """
+    cumulative = np.cumsum(hist)
+    count = int(cumulative[-1])
+    virtual_index = (count - 1) * (np.float64(percentile) / 100)
+    previous = int(np.floor(virtual_index))
+    if previous >= count - 1:
+        return float(np.searchsorted(cumulative, count - 1, side="right"))
+
+    # Values of the order statistics at `previous` and `previous + 1`
+    a, b = np.searchsorted(cumulative, [previous, previous + 1], side="right").astype(
+        np.float64
+    )
+    gamma = virtual_index - previous
+    if gamma >= 0.5:
+        return float(b - (b - a) * (1 - gamma))
+    return float(a + (b - a) * gamma)
+
+
+def channel_lut(values: np.ndarray) -> np.ndarray:
+    """
+    Pack the per-channel lookup tables of a BGR image into the (256, 1, 3) layout that
+    `cv2.LUT` applies to each channel in a single pass.
+
+    Args:
+        values (np.ndarray): The lookup table of each channel, of shape (3, 256).
+
+    Returns:
+        np.ndarray: The packed 8-bit lookup table.
+    """
+    return np.ascontiguousarray(values.T[:, np.newaxis, :]).astype(np.uint8)
+
+
+@dataclass(frozen=True)
+class GrayWorldWhiteBalance:
+    """
+    White balance stage of Approach1. Scales each channel so that the average B, G and R
+    intensities become equal (gray world assumption).
+
+    The per-channel averages are global statistics: `statistics` computes them once over the
+    whole image and `apply` scales any part of it, so the stage can run tile by tile. For
+    8-bit images the averages come from channel histograms and the scaling is a lookup
+    table, so no floating point copy of the image is made.
+    """
+
+    tileable = True
+
+    def statistics(self, image: np.ndarray) -> np.ndarray:
+        """
+        Compute the average intensity of each channel.
+
+        Args:
+            image (np.ndarray): An input image in BGR format.
+
+        Returns:
+            np.ndarray: The B, G and R averages.
+        """
+        if image.dtype not in (np.uint8, np.uint16):
+            totals = sum(
+                chunk.reshape(-1, chunk.shape[2]).sum(axis=0, dtype=np.float64)
+                for chunk in row_chunks(image)
+            )
+            return totals[:3] / (image.shape[0] * image.shape[1])
+        hist = histograms(image)
+        return hist @ np.arange(hist.shape[1]) / hist.sum(axis=1)
+
+    def apply(self, image: np.ndarray, averages: np.ndarray) -> np.ndarray:
+        """
+        Scale each channel by its correction factor and clip the results to the valid range.
+
+        Args:
+            image (np.ndarray): An input image (or tile) in BGR format.
+            averages (np.ndarray): The channel averages of the whole image.
+
+        Returns:
+            np.ndarray: The white-balanced BGR image, with the dtype of the input.
+        """
+        # A channel that is black everywhere is left as it is
+        averages = np.where(averages > 0, averages, averages.mean() or 1.0)
+        coefficients = (averages.mean() / averages).astype(np.float32)
+
+        if image.dtype == np.uint8:
+            levels = np.arange(256, dtype=np.float32)
+            lut = np.clip(levels * coefficients[:, np.newaxis], 0, 255)
+            return cv2.LUT(image, channel_lut(lut))
+
+        white = max_value(image.dtype)
+        return np.clip(image * coefficients, 0, white).astype(image.dtype)
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        return self.apply(image, self.statistics(image))
+
+
+@dataclass(frozen=True)
+class PercentileWhiteBalance:
+    """
+    White balance stage of Approach2. Normalizes each channel to its 99th percentile value
+    so that the brightest colors are mapped to pure white. The per-channel percentiles are
+    global statistics, so the stage can run tile by tile. They are read off channel
+    histograms, with 16-bit bins for floating point images, and for 8-bit images the scaling
+    is a lookup table.
+    """
+
+    percentile: float = 99.0
+    tileable = True
+
+    def statistics(self, image: np.ndarray) -> np.ndarray:
+        """
+        Find the maximum value of each channel at the configured percentile.
+
+        Args:
+            image (np.ndarray): An input image in BGR format.
+
+        Returns:
+            np.ndarray: The B, G and R maxima.
+        """
+        maxima = np.array(
+            [histogram_percentile(hist, self.percentile) for hist in histograms(image)[:3]]
+        )
+        # Floating point images are counted in 16-bit bins
+        if image.dtype not in (np.uint8, np.uint16):
+            return maxima / 65535.0
+        return maxima
+
+    def apply(self, image: np.ndarray, max_values: np.ndarray) -> np.ndarray:
+        """
+        Scale the image based on the maximum values to adjust white balance.
+
+        Args:
+            image (np.ndarray): An input image (or tile) in BGR format.
+            max_values (np.ndarray): The channel maxima of the whole image.
+
+        Returns:
+            np.ndarray: The white-balanced image, with the dtype of the input.
+        """
+        # A channel that is black everywhere is left as it is
+        max_values = np.where(max_values > 0, max_values, max_value(image.dtype))
+
+        if image.dtype == np.uint8:
+            levels = np.arange(256, dtype=np.float64)
+            lut = (levels / max_values[:, np.newaxis] * 255).clip(0, 255)
+            return cv2.LUT(image, channel_lut(lut))
+
+        white = max_value(image.dtype)
+        balanced = image.astype(np.float32) / max_values.astype(np.float32) * np.float32(white)
+        return balanced.clip(0, white).astype(image.dtype)
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        return self.apply(image, self.statistics(image))
+
+
+@dataclass(frozen=True)
+class HistogramEqualization:
+    """
+    Contrast stage of Approach1: global histogram equalization. The equalization lookup
+    table is built from the histogram of the whole image exactly as `cv2.equalizeHist`
+    does, so the stage can run tile by tile. 16-bit planes use a 65536-entry table and
+    floating point planes are quantized to 16 bits.
+    """
+
+    tileable = True
+
+    def statistics(self, gray: np.ndarray) -> np.ndarray:
+        """
+        Build the equalization lookup table of a grayscale image.
+
+        Args:
+            gray (np.ndarray): A grayscale input image.
+
+        Returns:
+            np.ndarray: The lookup table, with one entry per intensity level.
+        """
+        if gray.dtype not in (np.uint8, np.uint16):
+            gray = to_uint16(gray)
+        hist = histograms(gray)[0]
+        white = len(hist) - 1
+        lut = np.zeros(len(hist), dtype=gray.dtype)
+        first = int(np.flatnonzero(hist)[0])
+        if hist[first] == gray.size:
+            lut[:] = first
+            return lut
+
+        # Same float32 scale and round-half-to-even as OpenCV for 8-bit images; 16-bit
+        # counts need the precision of float64
+        precision = np.float32 if gray.dtype == np.uint8 else np.float64
+        scale = precision(white) / precision(gray.size - hist[first])
+        cumulative = np.cumsum(hist[first + 1 :]).astype(precision)
+        lut[first + 1 :] = np.clip(np.rint(cumulative * scale), 0, white)
+        return lut
+
+    def apply(self, gray: np.ndarray, lut: np.ndarray) -> np.ndarray:
+        if gray.dtype == np.uint8:
+            return cv2.LUT(gray, lut)
+        if gray.dtype == np.uint16:
+            return lut[gray]
+        return from_uint16(lut[to_uint16(gray)])
+
+    def __call__(self, gray: np.ndarray) -> np.ndarray:
+        if gray.dtype == np.uint8:
+            return cv2.equalizeHist(gray)
+        return self.apply(gray, self.statistics(gray))
+
+
+@dataclass(frozen=True)
+class Clahe:
+    """
+    Contrast stage of Approach2: Contrast Limited Adaptive Histogram Equalization. CLAHE
+    interpolates between neighbouring tiles of its own grid, so it always runs on the whole
+    grayscale plane.
+
+    The OpenCV CLAHE object keeps internal buffers between calls but is not thread-safe, so
+    each thread creates it once and reuses it for every following image or video frame.
+    """
+
+    clip_limit: float = 2.0
+    tile_grid: Tuple[int, int] = (8, 8)
+    tileable = False
+
+    def create(self) -> "cv2.CLAHE":
+        """
+        Return the CLAHE object of the current thread for these parameters.
+
+        Returns:
+            cv2.CLAHE: The cached CLAHE object.
+        """
+        cache = getattr(_clahe_objects, "cache", None)
+        if cache is None:
+            cache = _clahe_objects.cache = {}
+        clahe = cache.get(self)
+        if clahe is None:
+            clahe = cache[self] = cv2.createCLAHE(
+                clipLimit=self.clip_limit, tileGridSize=tuple(self.tile_grid)
+            )
+        return clahe
+
+    def __call__(self, gray: np.ndarray) -> np.ndarray:
+        # OpenCV's CLAHE handles 8 and 16-bit planes, with the clip limit relative to 256 or
+        # 65536 bins; floating point planes go through 16 bits
+        if gray.dtype in (np.uint8, np.uint16):
+            return self.create().apply(gray)
+        return from_uint16(self.create().apply(to_uint16(gray)))
+
+
+def luminance_weight_map(img: np.ndarray, color_order: str = "bgr") -> np.ndarray:
+    """
+    Calculate the luminance weight map of an image, normalized to the range [0, 1]. For a
+    grayscale image the Y channel of its YUV representation is the image itself, so the
+    color conversion is skipped.
+
+    Args:
+        img (np.ndarray): A grayscale or BGR image.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+
+    Returns:
+        np.ndarray: The normalized luminance weights of the image, in float64 for 8-bit
+            images (as the approaches compute them) and float32 otherwise.
+    """
+    if img.ndim == 2:
+        luminance = img
+    else:
+        luminance = cv2.cvtColor(img, conversion(color_order, "yuv"))[:, :, 0]
+    if img.dtype == np.uint8:
+        return luminance / 255.0
+    return luminance.astype(np.float32) / np.float32(max_value(img.dtype))
+
+
+def laplacian_magnitude(img: np.ndarray, color_order: str = "bgr") -> np.ndarray:
+    """
+    Calculate the magnitude of the Laplacian of an image's grayscale image. The Laplacian of
+    an 8-bit image fits in 16-bit integers and deeper images use float32, so no float64
+    plane is needed.
+
+    Args:
+        img (np.ndarray): A grayscale or BGR image.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+
+    Returns:
+        np.ndarray: The int16 (8-bit images) or float32 magnitudes.
+    """
+    gray = img if img.ndim == 2 else to_gray(img, color_order)
+    depth = cv2.CV_16S if gray.dtype == np.uint8 else cv2.CV_32F
+    return np.abs(cv2.Laplacian(gray, depth))
+
+
+def saliency_weight_map(
+    img: np.ndarray, color_order: str = "bgr", value_range: Optional[Tuple[float, float]] = None
+) -> np.ndarray:
+    """
+    Calculate the saliency weight map of an image: the magnitude of the Laplacian of its
+    grayscale image, min-max normalized to the range [0, 1].
+
+    Args:
+        img (np.ndarray): A grayscale or BGR image.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+        value_range (Optional[Tuple[float, float]]): The smallest and largest magnitude to
+            normalize by, those of `img` when None. A strip of a larger image passes the
+            range of the whole image to get its rows of the whole image's map.
+
+    Returns:
+        np.ndarray: The float32 saliency weights of the image.
+    """
+    saliency = laplacian_magnitude(img, color_order)
+    if value_range is None:
+        return cv2.normalize(
+            saliency, None, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_32F
+        )
+    return scale_to_unit(saliency, value_range)
+
+
+def scale_to_unit(values: np.ndarray, value_range: Tuple[float, float]) -> np.ndarray:
+    """
+    Map `value_range` linearly onto [0, 1] in float32, with the same arithmetic as the
+    NORM_MINMAX mode of `cv2.normalize`, so that the result is identical to normalizing an
+    array whose own range is `value_range`. Works on arrays and UMats.
+
+    Args:
+        values (np.ndarray): The values to scale.
+        value_range (Tuple[float, float]): The values mapped to 0 and 1.
+
+    Returns:
+        np.ndarray: The scaled float32 values.
+    """
+    low, high = value_range
+    scale = 1.0 / (high - low) if high - low > np.finfo(np.float64).eps else 0.0
+    return cv2.addWeighted(values, scale, values, 0.0, 0.0 - low * scale, dtype=cv2.CV_32F)
+
+
+def chromatic_weight_map(img: np.ndarray, color_order: str = "bgr") -> np.ndarray:
+    """
+    Calculate the chromatic weight map of an image: the saturation channel of its HSV
+    representation, normalized to the range [0, 1]. Grayscale images have no saturation.
+
+    Args:
+        img (np.ndarray): A grayscale or BGR image.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+
+    Returns:
+        np.ndarray: The float32 chromatic weights of the image.
+    """
+    if img.ndim == 2:
+        return np.zeros(img.shape, dtype=np.float32)
+    code = conversion(color_order, "hsv")
+    if img.dtype == np.uint8:
+        saturation = cv2.cvtColor(img, code)[:, :, 1]
+        return saturation.astype(np.float32) / 255.0
+    # OpenCV converts 8-bit and float32 images to HSV, where float32 saturation is in [0, 1]
+    scaled = img.astype(np.float32) / np.float32(max_value(img.dtype))
+    return cv2.cvtColor(scaled, code)[:, :, 1]
+
+
+# The weight maps a fusion can use, by name; each takes the image and its channel order
+WEIGHT_MAPS: Dict[str, Callable[[np.ndarray, str], np.ndarray]] = {
+    "luminance": luminance_weight_map,
+    "saliency": saliency_weight_map,
+    "chromatic": chromatic_weight_map,
+}
+
+
+def combine_weight_maps(maps: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Add up the weight maps of one fusion input. A single map is returned as it is.
+
+    Args:
+        maps (Sequence[np.ndarray]): The weight maps, all of the same shape.
+
+    Returns:
+        np.ndarray: The combined weight map.
+    """
+    if len(maps) == 1:
+        return maps[0]
+    combined = maps[0].astype(np.float32)
+    for weight_map in maps[1:]:
+        combined += weight_map
+    return combined
+
+
+def fusion_weight_map(
+    img: np.ndarray,
+    weight_maps: Sequence[str],
+    computed: Optional[Mapping[str, np.ndarray]] = None,
+    color_order: str = "bgr",
+) -> np.ndarray:
+    """
+    Combine the weight maps named in `weight_maps` for one fusion input. Maps that are not
+    named are never computed.
+
+    Args:
+        img (np.ndarray): The fusion input.
+        weight_maps (Sequence[str]): The weight maps to combine, keys of WEIGHT_MAPS.
+        computed (Optional[Mapping[str, np.ndarray]]): Maps of `img` the caller already has,
+            such as its luminance map, used instead of computing them again.
+        color_order (str): The channel order of `img`, "bgr" or "rgb".
+
+    Returns:
+        np.ndarray: The weight map of `img` in the fusion.
+    """
+    computed = computed or {}
+    maps = []
+    for kind in weight_maps:
+        if kind not in WEIGHT_MAPS:
+            raise ValueError(f"Unknown weight map: {kind}")
+        maps.append(computed[kind] if kind in computed else WEIGHT_MAPS[kind](img, color_order))
+    return combine_weight_maps(maps)
+
+
+def apply_luminance_map(
+    bgr: np.ndarray, luminance_map: np.ndarray, color_order: str = "bgr"
+) -> np.ndarray:
+    """
+    Apply a luminance weight map to the lightness channel of an image in LAB color space,
+    following `Approach1.apply_weight_maps`. The weighting `L * w + (1 - w) * L` is the
+    identity except for the truncation of the 8-bit result, so images of higher bit depth
+    are returned unchanged instead of making a lossy LAB round trip.
+
+    Args:
+        bgr (np.ndarray): An input image in BGR format.
+        luminance_map (np.ndarray): The luminance weight map of the image.
+        color_order (str): The channel order of `bgr`, "bgr" or "rgb".
+
+    Returns:
+        np.ndarray: The processed image in BGR format.
+    """
+    if bgr.dtype != np.uint8:
+        return bgr
+    lab = cv2.cvtColor(bgr, conversion(color_order, "lab"))
+
+    # Weights are normalized a second time, exactly as the approaches do
+    weights = luminance_map.astype(np.float32) / 255.0
+    lightness = lab[:, :, 0]
+    lab[:, :, 0] = (lightness * weights + (1 - weights) * lightness).astype(np.uint8)
+
+    return cv2.cvtColor(lab, conversion(color_order, "from_lab"))
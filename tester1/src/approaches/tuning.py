@@ -0,0 +1,167 @@
+"""
+Parameter sweeps.
+
+Tuning the approaches for a water type means trying a grid of parameters, such as CLAHE clip
+limits and tile grids, white balance percentiles and fusion weight maps, on a representative
+image. Running the pipeline once per combination repeats all the work the combinations have in
+common. A sweep runs every combination on a single FusionGraph instead. A node depends only on
+the stages that produce it, so the grayscale plane is computed once and each white balance
+once per percentile, whatever the clip limits and weight maps. Each fused image is scored
+with a no-reference quality metric as soon as it is ready and then dropped, so memory grows
+with the number of distinct intermediates rather than the number of combinations.
+"""
+import itertools
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from approaches import instrumentation
+from approaches.buffers import BufferPool
+from approaches.fusion import FusionGraph, FusionVariant, with_parameters
+from approaches.quality import METRICS
+from approaches.stages import downscale, to_bgr
+
+
+def parameter_grid(grid: Mapping[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """
+    Expand a grid into every combination of its values.
+
+    Args:
+        grid (Mapping[str, Sequence[Any]]): The values to try for each parameter.
+
+    Returns:
+        List[Dict[str, Any]]: One parameter set per combination, the last parameter varying
+            fastest.
+    """
+    names = list(grid)
+    values = []
+    for name in names:
+        if not grid[name]:
+            raise ValueError(f"No values to try for {name}")
+        # List values such as [4, 4] become tuples, like the stage fields they set
+        values.append([tuple(value) if isinstance(value, list) else value for value in grid[name]])
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def _format(value: Any) -> str:
+    if isinstance(value, tuple) and all(isinstance(item, int) for item in value):
+        return "x".join(str(item) for item in value)
+    if isinstance(value, tuple):
+        return "+".join(str(item) for item in value)
+    return str(value)
+
+
+def trial_name(parameters: Mapping[str, Any]) -> str:
+    """Name a parameter set, e.g. "clip_limit=3.0,tile_grid=4x4,weight_maps=luminance"."""
+    return ",".join(f"{name}={_format(value)}" for name, value in parameters.items())
+
+
+@dataclass(frozen=True)
+class Trial:
+    """One parameter set of a sweep and the score of its result."""
+
+    name: str
+    parameters: Dict[str, Any]
+    score: float
+
+    def report(self) -> dict:
+        return {"name": self.name, "parameters": self.parameters, "score": self.score}
+
+
+@dataclass(frozen=True)
+class SweepResult:
+    """The trials of a sweep, best score first."""
+
+    metric: str
+    trials: Tuple[Trial, ...]
+    size: Tuple[int, int]
+    elapsed_ms: float
+
+    @property
+    def best(self) -> Trial:
+        return self.trials[0]
+
+    def report(self) -> dict:
+        return {
+            "metric": self.metric,
+            "best": self.best.report(),
+            "trials": [trial.report() for trial in self.trials],
+            "image": {"width": self.size[0], "height": self.size[1]},
+            "elapsed_ms": round(self.elapsed_ms, 2),
+        }
+
+
+def sweep(
+    image: np.ndarray,
+    variant: FusionVariant,
+    grid: Mapping[str, Sequence[Any]],
+    metric: str = "uciqe",
+    executor: Optional[Executor] = None,
+    max_size: Optional[int] = None,
+) -> SweepResult:
+    """
+    Score every combination of a parameter grid on one image.
+
+    Args:
+        image (np.ndarray): The input image expected in BGR format.
+        variant (FusionVariant): The variant whose parameters are swept, e.g.
+            APPROACHES["approach2"].
+        grid (Mapping[str, Sequence[Any]]): The values to try for each parameter, keyed by
+            names from `variant_parameters`, e.g. {"clip_limit": [1.0, 2.0, 3.0]}.
+        metric (str): "uciqe" or "uiqm".
+        executor (Optional[Executor]): A thread pool running the combinations in parallel.
+            The threads share the graph, so each intermediate is still computed once.
+        max_size (Optional[int]): Sweep on a thumbnail whose longer side is at most this
+            long, instead of the full image.
+
+    Returns:
+        SweepResult: The score of every combination, best first.
+
+    Raises:
+        ValueError: If the metric or a parameter is unknown, or the executor runs processes.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown quality metric: {metric}")
+    if isinstance(executor, ProcessPoolExecutor) or getattr(executor, "uses_processes", False):
+        raise ValueError("A sweep shares one graph between its trials and needs threads")
+    score = METRICS[metric]
+
+    # Parameter sets resolving to the same variant, such as repeated values, run once
+    trials: Dict[FusionVariant, List[Dict[str, Any]]] = {}
+    for parameters in parameter_grid(grid):
+        trials.setdefault(with_parameters(variant, **parameters), []).append(parameters)
+
+    start = time.perf_counter()
+    with instrumentation.stage("sweep"):
+        if max_size is not None:
+            image = downscale(image, max_size)
+        graph = FusionGraph(to_bgr(image), buffers=BufferPool())
+
+        def evaluate(candidate: FusionVariant) -> float:
+            result = score(graph.fused(candidate))
+            graph.discard(("fused", candidate))
+            return round(result, 4)
+
+        if executor is None:
+            scores = {candidate: evaluate(candidate) for candidate in trials}
+        else:
+            # Shared intermediates every trial needs are computed before fanning out
+            graph.gray()
+            futures = {executor.submit(evaluate, candidate): candidate for candidate in trials}
+            scores = {futures[future]: future.result() for future in as_completed(futures)}
+
+    results = [
+        Trial(trial_name(parameters), parameters, scores[candidate])
+        for candidate, parameter_sets in trials.items()
+        for parameters in parameter_sets
+    ]
+    results.sort(key=lambda trial: trial.score, reverse=True)
+    return SweepResult(
+        metric=metric,
+        trials=tuple(results),
+        size=(image.shape[1], image.shape[0]),
+        elapsed_ms=(time.perf_counter() - start) * 1000,
+    )
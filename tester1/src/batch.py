@@ -0,0 +1,261 @@
+"""
+Enhance whole dive sessions from the command line.
+
+    python batch.py /data/dive-042 --output /data/dive-042-enhanced --format jpeg
+    python batch.py "/data/**/*.jpg" --output out --approach approach2 --workers 8
+
+Images are spread over a process pool. File reads are prefetched on background threads while
+the workers decode, enhance and encode, and every result is written as soon as it is ready.
+Outputs are written atomically, so an interrupted run resumes by skipping inputs whose outputs
+already exist.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from approaches.backends import configure_threads
+from approaches.fusion import APPROACHES, FusionPipeline
+from imaging import OutputFormat, decode_image, encode_image
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+# The pipeline of a worker process, created by the pool initializer
+_pipeline: Optional[FusionPipeline] = None
+
+
+@dataclass(frozen=True)
+class BatchJob:
+    """One input image and the output path of each approach."""
+
+    source: str
+    outputs: Dict[str, str]
+
+
+def _glob_root(pattern: str) -> str:
+    """The directory a glob pattern or file path starts from: its longest non-magic parent."""
+    root = os.path.dirname(pattern)
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root or os.curdir
+
+
+def find_images(inputs: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    Expand directories (recursively), glob patterns and plain files into image paths. Paths
+    are kept relative to the directory, or to the part of the pattern before its first
+    wildcard, so that "dives/**/*.jpg" keeps the dive subdirectories apart.
+
+    Args:
+        inputs (Iterable[str]): Directories, glob patterns or files.
+
+    Returns:
+        List[Tuple[str, str]]: (path, path relative to its input root) pairs, sorted.
+    """
+    found = {}
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                for name in files:
+                    path = os.path.join(root, name)
+                    found[path] = os.path.relpath(path, pattern)
+        else:
+            root = _glob_root(pattern)
+            for path in glob.glob(pattern, recursive=True) or [pattern]:
+                if os.path.isfile(path):
+                    found[path] = os.path.relpath(path, root)
+
+    return sorted(
+        (path, relative)
+        for path, relative in found.items()
+        if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+    )
+
+
+def plan_jobs(
+    images: Sequence[Tuple[str, str]],
+    output_dir: str,
+    names: Sequence[str],
+    output_format: OutputFormat,
+    resume: bool = True,
+) -> Tuple[List[BatchJob], int]:
+    """
+    Work out the output paths of every image, leaving out finished images when resuming.
+
+    Returns:
+        Tuple[List[BatchJob], int]: The jobs to run and the number of skipped images.
+
+    Raises:
+        ValueError: If two images would be written to the same output, such as a.jpg and
+            a.png, or files of the same name from two input directories.
+    """
+    jobs = []
+    skipped = 0
+    planned: Dict[str, str] = {}
+    for source, relative in images:
+        stem = os.path.splitext(relative)[0]
+        outputs = {
+            name: os.path.join(output_dir, f"{stem}.{name}{output_format.extension}")
+            for name in names
+        }
+        for path in outputs.values():
+            other = planned.setdefault(os.path.normpath(path), source)
+            if other != source:
+                raise ValueError(f"{other} and {source} would both be written to {path}")
+        if resume and all(os.path.exists(path) for path in outputs.values()):
+            skipped += 1
+            continue
+        jobs.append(BatchJob(source, outputs))
+    return jobs, skipped
+
+
+def _init_worker(names: Sequence[str]) -> None:
+    global _pipeline
+    # Every worker sizes its own OpenCV thread pool, see UNDERWATER_OPENCV_THREADS
+    configure_threads()
+    _pipeline = FusionPipeline({name: APPROACHES[name] for name in names})
+    _pipeline.warm_up()
+
+
+def _enhance(data: bytes, output_format: OutputFormat) -> Dict[str, bytes]:
+    """Decode, enhance and encode one image inside a worker process."""
+    results = _pipeline.process(decode_image(data))
+    return {name: encode_image(result, output_format).data for name, result in results.items()}
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def _write(path: str, data: bytes) -> None:
+    # Write through a temporary name so an interrupted run never leaves a partial output
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "wb") as file:
+        file.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def run_batch(
+    jobs: Sequence[BatchJob],
+    names: Sequence[str],
+    output_format: OutputFormat,
+    workers: Optional[int] = None,
+    prefetch: int = 8,
+    log=sys.stderr,
+) -> Tuple[int, int, float]:
+    """
+    Enhance a list of jobs on a process pool.
+
+    Args:
+        jobs (Sequence[BatchJob]): The images to enhance.
+        names (Sequence[str]): The approaches to run.
+        output_format (OutputFormat): The encoding of the outputs.
+        workers (Optional[int]): Worker processes, defaults to the number of CPUs.
+        prefetch (int): Images read ahead of the workers.
+        log: Stream that receives progress lines.
+
+    Returns:
+        Tuple[int, int, float]: Images done, images failed and elapsed seconds.
+    """
+    workers = workers or os.cpu_count() or 1
+    in_flight = max(workers * 2, 1)
+    pending_reads = deque()
+    running = {}
+    done = failed = 0
+    start = time.perf_counter()
+    queue = iter(jobs)
+
+    readers = ThreadPoolExecutor(max_workers=max(1, min(prefetch, 4)))
+    pool = ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(list(names),)
+    )
+    with readers, pool:
+
+        def report_failure(job: BatchJob, error: Exception) -> None:
+            nonlocal failed
+            failed += 1
+            print(f"failed: {job.source}: {error}", file=log)
+
+        def fill() -> None:
+            # Keep the read-ahead queue and the pool full
+            while len(pending_reads) < prefetch:
+                job = next(queue, None)
+                if job is None:
+                    break
+                pending_reads.append((job, readers.submit(_read, job.source)))
+            while pending_reads and len(running) < in_flight:
+                job, read = pending_reads.popleft()
+                try:
+                    running[pool.submit(_enhance, read.result(), output_format)] = job
+                except OSError as error:
+                    report_failure(job, error)
+
+        fill()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                try:
+                    for name, data in future.result().items():
+                        _write(job.outputs[name], data)
+                    done += 1
+                except Exception as error:
+                    report_failure(job, error)
+
+            elapsed = time.perf_counter() - start
+            if done and done % 50 == 0:
+                print(f"{done}/{len(jobs)} images, {done / elapsed:.2f} images/s", file=log)
+            fill()
+
+    return done, failed, time.perf_counter() - start
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Enhance a batch of underwater images.")
+    parser.add_argument("inputs", nargs="+", help="directories, glob patterns or files")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument(
+        "-a",
+        "--approach",
+        action="append",
+        choices=sorted(APPROACHES),
+        help="approach to run, repeatable (default: all)",
+    )
+    parser.add_argument("-f", "--format", default="png", help="png, jpeg or webp")
+    parser.add_argument("-q", "--quality", type=int, help="quality or PNG compression level")
+    parser.add_argument("-w", "--workers", type=int, help="worker processes (default: CPUs)")
+    parser.add_argument("--prefetch", type=int, default=8, help="images read ahead")
+    parser.add_argument(
+        "--no-resume", action="store_true", help="redo images whose outputs already exist"
+    )
+    args = parser.parse_args(argv)
+
+    names = args.approach or list(APPROACHES)
+    try:
+        output_format = OutputFormat(args.format, args.quality)
+    except ValueError as error:
+        parser.error(str(error))
+    images = find_images(args.inputs)
+    try:
+        jobs, skipped = plan_jobs(images, args.output, names, output_format, not args.no_resume)
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"{len(images)} images found, {skipped} already done", file=sys.stderr)
+
+    done, failed, elapsed = run_batch(jobs, names, output_format, args.workers, args.prefetch)
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(
+        f"{done} images enhanced, {failed} failed in {elapsed:.1f}s ({rate:.2f} images/s)",
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
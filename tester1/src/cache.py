@@ -0,0 +1,244 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def image_digest(image: np.ndarray) -> str:
+    """
+    Hash the decoded pixels of an image together with its shape and dtype, so that the same
+    photo uploaded twice (in any container format) maps to the same digest.
+
+    Args:
+        image (np.ndarray): The decoded image.
+
+    Returns:
+        str: The hex digest of the image.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.shape}{image.dtype}".encode())
+    digest.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+    return digest.hexdigest()
+
+
+def cache_key(digest: str, approach: str, **params) -> str:
+    """
+    Build the cache key of one enhanced output.
+
+    Args:
+        digest (str): The digest of the input image.
+        approach (str): The name of the approach that produced the output.
+        **params: Everything else the output depends on, such as the output format.
+
+    Returns:
+        str: The cache key.
+    """
+    suffix = ",".join(f"{name}={params[name]}" for name in sorted(params))
+    return hashlib.blake2b(
+        f"{digest}|{approach}|{suffix}".encode(), digest_size=16
+    ).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of encoded results bounded by a byte budget. Entries evicted from memory spill
+    to an optional on-disk tier, itself bounded, and are promoted back to memory on a hit.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 2 * 1024 * 1024 * 1024,
+    ) -> None:
+        """
+        Initialize the cache
+
+        Args:
+            max_bytes (int): The memory budget in bytes.
+            directory (Optional[str]): Directory of the on-disk tier, disabled when None.
+            max_disk_bytes (int): The disk budget in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._disk_entries: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        # Evicted entries being written to disk, served from memory until the write is done
+        self._spilling: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # Resume the disk tier in least recently written order
+            paths = [
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if not name.endswith(".tmp")
+            ]
+            for path in sorted(paths, key=os.path.getmtime):
+                size = os.path.getsize(path)
+                self._disk_entries[os.path.basename(path)] = size
+                self._disk_bytes += size
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultCache"]:
+        """
+        Build the cache configured by the UNDERWATER_CACHE_BYTES (0 disables the cache),
+        UNDERWATER_CACHE_DIR and UNDERWATER_CACHE_DISK_BYTES environment variables.
+
+        Returns:
+            Optional[ResultCache]: The cache, or None when caching is disabled.
+        """
+        max_bytes = int(os.environ.get("UNDERWATER_CACHE_BYTES", 256 * 1024 * 1024))
+        if max_bytes <= 0:
+            return None
+        disk_bytes = os.environ.get("UNDERWATER_CACHE_DISK_BYTES")
+        return cls(
+            max_bytes,
+            directory=os.environ.get("UNDERWATER_CACHE_DIR"),
+            max_disk_bytes=int(disk_bytes) if disk_bytes else 2 * 1024 * 1024 * 1024,
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Look up an entry, promoting disk entries back to memory. Disk reads and the writes of
+        the entries this evicts happen outside the lock, so lookups of other requests only
+        wait for the in-memory bookkeeping.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Optional[bytes]: The cached data, or None on a miss.
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                # Evicted entries whose disk write is still in progress are still at hand
+                data = self._spilling.get(key)
+            if data is not None:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            if self.directory is None or key not in self._disk_entries:
+                self.misses += 1
+                return None
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            if key in self._disk_entries:
+                self._disk_entries.move_to_end(key)
+            evicted = self._insert(key, data)
+        self._spill(evicted)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Store an entry, evicting the least recently used entries beyond the budget.
+
+        Args:
+            key (str): The cache key.
+            data (bytes): The data to store.
+        """
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            evicted = self._insert(key, data)
+        self._spill(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "disk_entries": len(self._disk_entries),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _insert(self, key: str, data: bytes) -> List[Tuple[str, bytes]]:
+        # Called with the lock held; returns the evicted entries for _spill
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = data
+        self._bytes += len(data)
+
+        evicted = []
+        while self._bytes > self.max_bytes:
+            evicted_key, evicted_data = self._entries.popitem(last=False)
+            self._bytes -= len(evicted_data)
+            self.evictions += 1
+            evicted.append((evicted_key, evicted_data))
+        return evicted
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.directory, key), "rb") as file:
+                return file.read()
+        except OSError:
+            with self._lock:
+                size = self._disk_entries.pop(key, None)
+                if size is not None:
+                    self._disk_bytes -= size
+            return None
+
+    def _spill(self, evicted: List[Tuple[str, bytes]]) -> None:
+        """Write evicted entries to the disk tier, without holding the lock."""
+        if self.directory is None:
+            return
+        for key, data in evicted:
+            # Reserve the space and drop the stale entries it needs under the lock ...
+            with self._lock:
+                if key in self._disk_entries or key in self._spilling:
+                    continue
+                if len(data) > self.max_disk_bytes:
+                    continue
+                stale = []
+                while self._disk_entries and self._disk_bytes + len(data) > self.max_disk_bytes:
+                    stale_key, size = self._disk_entries.popitem(last=False)
+                    self._disk_bytes -= size
+                    stale.append(stale_key)
+                self._disk_bytes += len(data)
+                self._spilling[key] = data
+
+            # ... and touch the files outside it
+            for stale_key in stale:
+                try:
+                    os.remove(os.path.join(self.directory, stale_key))
+                except OSError:
+                    pass
+            written = True
+            try:
+                # Write through a temporary name so readers never see a partial file
+                path = os.path.join(self.directory, key)
+                with open(path + ".tmp", "wb") as file:
+                    file.write(data)
+                os.replace(path + ".tmp", path)
+            except OSError:
+                written = False
+
+            with self._lock:
+                del self._spilling[key]
+                if written:
+                    self._disk_entries[key] = len(data)
+                else:
+                    self._disk_bytes -= len(data)
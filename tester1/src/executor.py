@@ -0,0 +1,80 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+class ApproachExecutor(Executor):
+    """
+    Runs approach jobs on a thread or process pool while limiting how many jobs are in
+    flight at once. Submitting blocks once the limit is reached, so a burst of uploads queues
+    up in front of the pool instead of oversubscribing the CPU.
+    """
+
+    def __init__(
+        self,
+        mode: str = "thread",
+        max_workers: Optional[int] = None,
+        max_jobs: Optional[int] = None,
+    ) -> None:
+        """
+        Initialize the executor
+
+        Args:
+            mode (str): "thread" to share memory between jobs or "process" to isolate them.
+            max_workers (Optional[int]): Size of the pool, defaults to the number of CPUs.
+            max_jobs (Optional[int]): Maximum number of jobs running or queued in the pool,
+                defaults to twice the pool size.
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown executor mode: {mode}")
+
+        max_workers = max_workers or os.cpu_count() or 1
+        self.mode = mode
+        self.uses_processes = mode == "process"
+        if self.uses_processes:
+            self._pool: Executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="approach"
+            )
+        self._jobs = threading.BoundedSemaphore(max_jobs or 2 * max_workers)
+
+    @classmethod
+    def from_env(cls) -> Optional["ApproachExecutor"]:
+        """
+        Build the executor configured by the UNDERWATER_EXECUTOR ("thread", "process" or
+        "none"), UNDERWATER_WORKERS and UNDERWATER_MAX_JOBS environment variables.
+
+        Returns:
+            Optional[ApproachExecutor]: The executor, or None to run approaches inline.
+        """
+        mode = os.environ.get("UNDERWATER_EXECUTOR", "thread")
+        if mode == "none":
+            return None
+        workers = os.environ.get("UNDERWATER_WORKERS")
+        max_jobs = os.environ.get("UNDERWATER_MAX_JOBS")
+        return cls(
+            mode,
+            max_workers=int(workers) if workers else None,
+            max_jobs=int(max_jobs) if max_jobs else None,
+        )
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        self._jobs.acquire()
+        try:
+            if self.uses_processes:
+                future = self._pool.submit(fn, *args, **kwargs)
+            else:
+                # Carry the caller's context along, so stages record into its request
+                context = contextvars.copy_context()
+                future = self._pool.submit(context.run, fn, *args, **kwargs)
+        except BaseException:
+            self._jobs.release()
+            raise
+        future.add_done_callback(lambda _: self._jobs.release())
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
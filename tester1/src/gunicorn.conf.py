@@ -0,0 +1,15 @@
+import multiprocessing
+import os
+
+# One worker process per core; each worker also runs the approaches of a request in parallel
+# on its own executor (see UNDERWATER_EXECUTOR / UNDERWATER_WORKERS / UNDERWATER_MAX_JOBS)
+bind = os.environ.get("UNDERWATER_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("UNDERWATER_SERVER_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("UNDERWATER_SERVER_THREADS", 2))
+worker_class = "gthread"
+timeout = int(os.environ.get("UNDERWATER_TIMEOUT", 120))
+
+# Uploads can be large; keep slow clients from holding a worker forever
+keepalive = 5
+max_requests = 1000
+max_requests_jitter = 100
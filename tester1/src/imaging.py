@@ -0,0 +1,225 @@
+import base64
+import io
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from approaches.stages import COLOR_ORDERS, reorder
+
+# Photos above this size are encoded as JPEG unless PNG is asked for explicitly
+LARGE_IMAGE_PIXELS = 4_000_000
+
+FORMATS = {
+    # name: (extension, MIME type, OpenCV quality flag, default quality, quality range)
+    "png": (".png", "image/png", cv2.IMWRITE_PNG_COMPRESSION, 3, (0, 9)),
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY, 90, (0, 100)),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY, 90, (1, 100)),
+}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+# Scales at which the JPEG decoder can decode directly, largest reduction first
+JPEG_REDUCTIONS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    """
+    An output encoding. `quality` is the compression level (0-9) for PNG and the quality
+    (0-100) for JPEG and WebP.
+    """
+
+    name: str = "png"
+    quality: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.name, str):
+            raise ValueError("The output format must be a format name such as 'png'")
+        name = FORMAT_ALIASES.get(self.name.lower(), self.name.lower())
+        if name not in FORMATS:
+            raise ValueError(f"Unsupported output format: {self.name}")
+        low, high = FORMATS[name][4]
+        # bool is an int subclass, but {"quality": true} is not a quality
+        if self.quality is not None and (
+            not isinstance(self.quality, int) or isinstance(self.quality, bool)
+        ):
+            raise ValueError(f"Quality for {name} must be an integer between {low} and {high}")
+        if self.quality is not None and not low <= self.quality <= high:
+            raise ValueError(f"Quality for {name} must be between {low} and {high}")
+        object.__setattr__(self, "name", name)
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.name][0]
+
+    @property
+    def mime_type(self) -> str:
+        return FORMATS[self.name][1]
+
+    @property
+    def params(self) -> list:
+        _, _, flag, default, _ = FORMATS[self.name]
+        return [flag, default if self.quality is None else self.quality]
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """An encoded image together with what it cost to produce."""
+
+    data: bytes
+    format: OutputFormat
+    encode_ms: float
+    cached: bool = False
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def data_url(self) -> str:
+        return f"data:{self.format.mime_type};base64,{base64.b64encode(self.data).decode()}"
+
+    def report(self) -> dict:
+        return {
+            "format": self.format.name,
+            "bytes": self.size,
+            "encode_ms": round(self.encode_ms, 2),
+            "cached": self.cached,
+        }
+
+
+def choose_output_format(
+    shape: tuple,
+    name: Optional[str] = None,
+    quality: Optional[int] = None,
+    accepted: Iterable[str] = (),
+) -> OutputFormat:
+    """
+    Pick the output format of a response. An explicit format name wins, then the first
+    supported MIME type the client accepts, then a size-based default: PNG for small images
+    and JPEG for large photos, where PNG encoding is slow and the responses are huge.
+
+    Args:
+        shape (tuple): The shape of the image to encode.
+        name (Optional[str]): The requested format name, or "auto".
+        quality (Optional[int]): The requested quality or compression level.
+        accepted (Iterable[str]): MIME types from the Accept header, in preference order.
+
+    Returns:
+        OutputFormat: The format to encode with.
+
+    Raises:
+        ValueError: If the format or quality is invalid.
+    """
+    if name is not None and not isinstance(name, str):
+        raise ValueError("The output format must be a format name such as 'png'")
+    if name and name != "auto":
+        return OutputFormat(name, quality)
+
+    for mime_type in accepted:
+        for format_name, (_, format_mime, _, _, _) in FORMATS.items():
+            if mime_type == format_mime:
+                return OutputFormat(format_name, quality)
+
+    large = shape[0] * shape[1] > LARGE_IMAGE_PIXELS
+    return OutputFormat("jpeg" if large else "png", quality)
+
+
+def image_size(data: bytes) -> Tuple[int, int]:
+    """
+    Read the size of an encoded image from its header without decoding the pixels. EXIF
+    orientation is not applied, so the sides may be swapped; the area is the same.
+
+    Args:
+        data (bytes): The encoded image.
+
+    Returns:
+        Tuple[int, int]: The height and width of the image.
+
+    Raises:
+        ValueError: If the header cannot be read.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+    except OSError as error:
+        raise ValueError("Could not decode the uploaded image") from error
+    return height, width
+
+
+def decode_image(
+    data: bytes, min_size: Optional[int] = None, color_order: str = "bgr"
+) -> np.ndarray:
+    """
+    Ingest an encoded image (PNG, JPEG, WebP, ...): decode it straight into a contiguous
+    3-channel 8-bit array in the requested channel order and apply its EXIF orientation.
+    Grayscale, palette, alpha and 16-bit inputs are all normalized here, once, so nothing
+    downstream has to check the channel count or depth. The bytes are wrapped without copying
+    before being handed to OpenCV.
+
+    When only a smaller image is needed, JPEGs are decoded at 1/2, 1/4 or 1/8 scale by the
+    JPEG decoder itself, which is several times faster than decoding in full and shrinking.
+
+    Args:
+        data (bytes): The encoded image.
+        min_size (Optional[int]): The smallest longer side the caller needs. The largest
+            reduction keeping the longer side at least this long is used.
+        color_order (str): "bgr", or "rgb" to have the decoder write RGB pixels itself
+            rather than converting afterwards.
+
+    Returns:
+        np.ndarray: The decoded image in `color_order`.
+
+    Raises:
+        ValueError: If the data is not an image OpenCV can decode.
+    """
+    if color_order not in COLOR_ORDERS:
+        raise ValueError(f"Unknown color order: {color_order}")
+    flag = cv2.IMREAD_COLOR
+    if min_size is not None and data[:3] == b"\xff\xd8\xff":
+        try:
+            longer = max(image_size(data))
+        except ValueError:
+            longer = 0
+        for factor, reduced in JPEG_REDUCTIONS:
+            if longer // factor >= min_size:
+                flag = reduced
+                break
+    if color_order == "rgb":
+        flag = (flag & ~cv2.IMREAD_COLOR) | cv2.IMREAD_COLOR_RGB
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    image = cv2.imdecode(buffer, flag) if buffer.size else None
+    if image is None:
+        raise ValueError("Could not decode the uploaded image")
+    return image
+
+
+def encode_image(
+    image: np.ndarray, output_format: OutputFormat, color_order: str = "bgr"
+) -> EncodedImage:
+    """
+    Encode an image with OpenCV and time the encoding. OpenCV encoders read BGR, so RGB
+    images are passed as a reversed channel view rather than converted.
+
+    Args:
+        image (np.ndarray): The image in BGR format.
+        output_format (OutputFormat): The encoding to use.
+        color_order (str): The channel order of `image`, "bgr" or "rgb".
+
+    Returns:
+        EncodedImage: The encoded bytes, their format and the encode time.
+    """
+    start = time.perf_counter()
+    image = reorder(image, color_order, "bgr")
+    ok, encoded = cv2.imencode(output_format.extension, image, output_format.params)
+    if not ok:
+        raise ValueError(f"Could not encode the image as {output_format.name}")
+    elapsed = (time.perf_counter() - start) * 1000
+    return EncodedImage(encoded.tobytes(), output_format, elapsed)
@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+@dataclass
+class Job:
+    """
+    A unit of work run outside the request that created it.
+
+    Attributes:
+        id (str): The job ID handed to the client.
+        status (str): "pending", "running", "done" or "failed".
+        result (Any): The return value of the job once it is done.
+        error (Optional[str]): The error message if the job failed.
+        created (float): Creation time as a UNIX timestamp.
+        finished (Optional[float]): Completion time as a UNIX timestamp.
+        expires (Optional[float]): Time after which the store forgets the job.
+    """
+
+    id: str
+    status: str = "pending"
+    result: Any = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    expires: Optional[float] = None
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobStore(ABC):
+    """
+    Where jobs live between the request that submits them and the requests that poll them.
+    The manager writes a job back with `put` after every state change, so a store shared by
+    several server nodes only has to persist what it is given.
+    """
+
+    @abstractmethod
+    def put(self, job: Job) -> None:
+        """Insert or update a job."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return a job, or None if it does not exist or has expired."""
+
+    @abstractmethod
+    def delete(self, job_id: str) -> None:
+        """Forget a job."""
+
+
+class MemoryJobStore(JobStore):
+    """Job store of a single process. Expired jobs are dropped whenever a job is stored."""
+
+    def __init__(self) -> None:
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def put(self, job: Job) -> None:
+        with self._lock:
+            now = time.time()
+            expired = [
+                job_id
+                for job_id, stored in self._jobs.items()
+                if stored.expires is not None and stored.expires < now
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.expires is not None and job.expires < time.time():
+                del self._jobs[job_id]
+                return None
+            return job
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded background thread pool, or defers them until a client asks for
+    their result. At most `max_queued` jobs wait or run at once and at most `max_deferred`
+    wait to be asked for; beyond that `submit` raises JobQueueFull so callers can push back.
+    Finished jobs are kept for `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        max_queued: int = 16,
+        ttl: float = 600.0,
+        store: Optional[JobStore] = None,
+        max_deferred: int = 64,
+    ) -> None:
+        """
+        Initialize the manager
+
+        Args:
+            workers (int): Number of jobs run at the same time.
+            max_queued (int): Maximum number of jobs waiting or running in the pool.
+            ttl (float): Seconds a finished (or deferred) job is kept.
+            store (Optional[JobStore]): Where jobs are kept, a MemoryJobStore by default.
+            max_deferred (int): Maximum number of deferred jobs, which hold their inputs in
+                memory until they are run or expire.
+        """
+        self.max_queued = max_queued
+        self.max_deferred = max_deferred
+        self.ttl = ttl
+        self.store = store or MemoryJobStore()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._deferred: Dict[str, Callable[[], Any]] = {}
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "JobManager":
+        """
+        Build the manager configured by the UNDERWATER_JOB_WORKERS, UNDERWATER_JOB_QUEUE,
+        UNDERWATER_JOB_DEFERRED and UNDERWATER_JOB_TTL environment variables.
+
+        Returns:
+            JobManager: The manager, keeping its jobs in memory.
+        """
+        return cls(
+            workers=int(os.environ.get("UNDERWATER_JOB_WORKERS", 1)),
+            max_queued=int(os.environ.get("UNDERWATER_JOB_QUEUE", 16)),
+            ttl=float(os.environ.get("UNDERWATER_JOB_TTL", 600)),
+            max_deferred=int(os.environ.get("UNDERWATER_JOB_DEFERRED", 64)),
+        )
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def submit(self, fn: Callable, *args, deferred: bool = False) -> Job:
+        """
+        Create a job running `fn(*args)`.
+
+        Args:
+            fn (Callable): The work of the job.
+            *args: The arguments of `fn`.
+            deferred (bool): Wait for the first `run` call instead of starting right away.
+
+        Returns:
+            Job: The new job.
+
+        Raises:
+            JobQueueFull: If `max_queued` jobs are already waiting or running, or for a
+                deferred job, if `max_deferred` deferred jobs are already waiting.
+        """
+        job = Job(uuid.uuid4().hex)
+        work = partial(fn, *args)
+
+        if deferred:
+            job.expires = job.created + self.ttl
+            with self._lock:
+                self._forget_deferred()
+                if len(self._deferred) >= self.max_deferred:
+                    raise JobQueueFull(f"{len(self._deferred)} deferred jobs are already waiting")
+                self._deferred[job.id] = work
+            self.store.put(job)
+            return job
+
+        with self._lock:
+            if self._queued >= self.max_queued:
+                raise JobQueueFull(f"{self._queued} jobs are already queued")
+            self._queued += 1
+        self.store.put(job)
+        self._pool.submit(self._execute, job, work, True)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.store.get(job_id)
+
+    def run(self, job_id: str) -> Optional[Job]:
+        """
+        Run a deferred job on the calling thread. Jobs that are not deferred are returned
+        as they are.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            Optional[Job]: The job, or None if it does not exist.
+        """
+        job = self.store.get(job_id)
+        with self._lock:
+            work = self._deferred.pop(job_id, None)
+        if job is not None and work is not None:
+            self._execute(job, work, False)
+        return job
+
+    def _forget_deferred(self) -> None:
+        # Deferred work whose job expired before anyone asked for it is never run
+        for job_id in [job_id for job_id in self._deferred if self.store.get(job_id) is None]:
+            del self._deferred[job_id]
+
+    def _execute(self, job: Job, work: Callable[[], Any], queued: bool) -> None:
+        job.status = "running"
+        self.store.put(job)
+        try:
+            job.result = work()
+            job.status = "done"
+        except Exception as error:
+            job.error = str(error)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            job.expires = job.finished + self.ttl
+            self.store.put(job)
+            if queued:
+                with self._lock:
+                    self._queued -= 1
@@ -1,50 +1,643 @@
-from flask import Flask, request, jsonify
-import numpy as np
-from PIL import Image
-import io
+from startup import Startup  # first, so that the import timing covers Flask too
+from flask import Flask, Response, g, request, jsonify
+import json
+import os
 import base64
+import threading
+import time
+import uuid
 from flask_cors import CORS
-from approaches.Approach1 import Approach1
-from approaches.Approach2 import Approach2
+from approaches import instrumentation
+from executor import ApproachExecutor
+from jobs import JobManager, JobQueueFull
+
+# OpenCV, NumPy and PIL come in through approaches.fusion, approaches.selection, cache and
+# imaging. Those modules are imported by load_image_stack and, after it, by the functions
+# that use them, so that UNDERWATER_STARTUP=lazy can keep them out of the module import.
 
 app = Flask(__name__)
 CORS(app)
 
+# Cold-start timings, and whether this worker is ready to serve images
+startup = Startup.from_env()
+
+# Keep OpenCV's lazy initialization out of the first request of every worker
+WARM_UP = os.environ.get("UNDERWATER_WARM_UP", "1") == "1"
+
+# Requests that enhance an image; the first one is the cold start clients see
+IMAGE_ENDPOINTS = ("filter_image", "filter_image_stream", "filter_image_binary", "submit_job")
+
+# Requests that need the image stack loaded. Everything else, including CORS preflights and
+# unknown routes, is served without waiting for it
+IMAGE_STACK_ENDPOINTS = IMAGE_ENDPOINTS + ("filter_image_job", "job_result", "cache_stats")
+
+# Set by load_image_stack: the pipeline running Approach1 and Approach2 together, the
+# selector of "auto" requests and the cache of encoded results, keyed by pixels, approach,
+# its configuration and output format (None when disabled)
+pipeline = None
+selector = None
+cache = None
+_image_stack_lock = threading.Lock()
+
+# Images above this many pixels are processed in strips of TILE_ROWS rows to bound memory
+TILE_PIXELS = int(os.environ.get("UNDERWATER_TILE_PIXELS", 24_000_000))
+TILE_ROWS = int(os.environ.get("UNDERWATER_TILE_ROWS", 512))
+
+# Queued enhancements and the full-resolution follow-ups of preview requests
+jobs = JobManager.from_env()
+FULL_RESOLUTION_MODES = ("background", "on_request", "none")
+
+# Seconds clients are told to wait before resubmitting when the job queue is full
+RETRY_AFTER = 5
+
+# Adds a Server-Timing header with the stage times of each request (needs UNDERWATER_METRICS=1)
+SERVER_TIMING = os.environ.get("UNDERWATER_SERVER_TIMING", "0") == "1"
+
+# The approach pool is created on first use so that every server worker process owns its own
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ApproachExecutor.from_env()
+        return _executor
+
+
+def load_image_stack():
+    """
+    Import the image processing modules, build the pipeline, the selector and the result
+    cache, and warm the pipeline up, once per worker. Concurrent callers wait for the first
+    one. Runs while main is imported by default, and in a background thread with
+    UNDERWATER_STARTUP=lazy.
+    """
+    global pipeline, selector, cache
+    if pipeline is not None:
+        return
+    with _image_stack_lock:
+        if pipeline is not None:
+            return
+        try:
+            with startup.timed("import_image_stack"):
+                import imaging  # noqa: F401
+                from approaches.backends import configure_threads
+                from approaches.fusion import FusionPipeline
+                from approaches.selection import ApproachSelector
+                from cache import ResultCache
+
+            configure_threads()
+            loaded = FusionPipeline.from_env()
+            if WARM_UP:
+                with startup.timed("warm_up"):
+                    loaded.warm_up()
+            selector = ApproachSelector.from_env(loaded)
+            cache = ResultCache.from_env()
+        except Exception as error:
+            startup.error = f"{type(error).__name__}: {error}"
+            raise
+        startup.error = None
+        pipeline = loaded
+    startup.mark_ready()
+
+
+@app.before_request
+def start_timing():
+    instrumentation.start_request()
+    g.request_started = time.perf_counter()
+    if request.method != "OPTIONS" and request.endpoint in IMAGE_STACK_ENDPOINTS:
+        load_image_stack()
+
+
+@app.after_request
+def add_server_timing(response):
+    if (
+        request.method != "OPTIONS"
+        and request.endpoint in IMAGE_ENDPOINTS
+        and "request_started" in g
+    ):
+        startup.record("first_request", (time.perf_counter() - g.request_started) * 1000)
+    if SERVER_TIMING:
+        timing = instrumentation.server_timing()
+        if timing:
+            response.headers["Server-Timing"] = timing
+    return response
+
+
+def enhance_iter(image_array, output_format, names=None):
+    """
+    Run the approaches on an image and yield each encoded result as soon as it is ready.
+    Outputs already in the cache come first, without running their approach.
+
+    Args:
+        image_array (np.ndarray): The decoded input image.
+        output_format (OutputFormat): The encoding of the results.
+        names (Optional[Iterable[str]]): The approaches to run, all of them when None.
+
+    Yields:
+        tuple: The name and EncodedImage of each approach, in the order they finish.
+    """
+    from cache import cache_key, image_digest
+    from imaging import EncodedImage, encode_image
+
+    names = list(pipeline.variants) if names is None else list(names)
+    keys = {}
+    missing = []
+    if cache is not None:
+        with instrumentation.stage("digest"):
+            digest = image_digest(image_array)
+    for name in names:
+        if cache is None:
+            missing.append(name)
+            continue
+        keys[name] = cache_key(
+            digest,
+            name,
+            variant=pipeline.fingerprint(name),
+            format=output_format.name,
+            quality=output_format.quality,
+        )
+        data = cache.get(keys[name])
+        if data is None:
+            missing.append(name)
+        else:
+            yield name, EncodedImage(data, output_format, 0.0, cached=True)
+    if not missing:
+        return
+
+    if image_array.shape[0] * image_array.shape[1] > TILE_PIXELS:
+        with instrumentation.stage("process"):
+            tiled = pipeline.process_tiled(image_array, tile_rows=TILE_ROWS, names=missing)
+        results = iter(tiled.items())
+    else:
+        results = pipeline.process_iter(image_array, executor=get_executor(), names=missing)
+    while True:
+        with instrumentation.stage("process"):
+            item = next(results, None)
+        if item is None:
+            return
+        name, result = item
+        with instrumentation.stage("encode"):
+            encoded = encode_image(result, output_format)
+        if cache is not None:
+            cache.put(keys[name], encoded.data)
+        yield name, encoded
+
+
+def enhance(image_array, output_format, names=None):
+    """
+    Run the approaches on an image and encode their results. Outputs already in the cache
+    are returned without running their approach.
+
+    Args:
+        image_array (np.ndarray): The decoded input image.
+        output_format (OutputFormat): The encoding of the results.
+        names (Optional[Iterable[str]]): The approaches to run, all of them when None.
+
+    Returns:
+        dict: The EncodedImage of each approach, keyed by approach name.
+    """
+    names = list(pipeline.variants) if names is None else list(names)
+    encoded = dict(enhance_iter(image_array, output_format, names))
+    return {name: encoded[name] for name in names}
+
+
+def choose_approaches(image_array, approach):
+    """
+    Resolve the "approach" of a request to the approaches to run.
+
+    Args:
+        image_array (np.ndarray): The decoded input image.
+        approach (Optional[str]): An approach name, "auto" or None for all of them.
+
+    Returns:
+        tuple: The approach names (None for all of them) and the Selection made for "auto".
+
+    Raises:
+        ValueError: If the approach is unknown.
+    """
+    if approach is None:
+        return None, None
+    if approach == "auto":
+        selection = selector.select(image_array)
+        return [selection.approach], selection
+    if approach not in pipeline.variants:
+        raise ValueError(f"Unknown approach: {approach}")
+    return [approach], None
+
+
+def enhanced_json(encoded, selection=None):
+    with instrumentation.stage("base64"):
+        response = {name: image.data_url() for name, image in encoded.items()}
+        response["encoding"] = {name: image.report() for name, image in encoded.items()}
+    if selection is not None:
+        response["selection"] = selection.report()
+    return response
+
+
+class UploadError(Exception):
+    """An upload that cannot be processed, answered with `status`."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+@app.errorhandler(UploadError)
+def upload_error(error):
+    return jsonify({"error": str(error)}), error.status
+
+
+def read_json_upload():
+    """
+    Read the request body of the JSON endpoints: a base64 data URL "image" plus the
+    optional "approach", "format", "quality" and "preview" fields. With "preview", JPEGs
+    are decoded at a reduced scale that still covers the preview size, and the full image
+    is decoded later by its full-resolution job.
+
+    Returns:
+        tuple: The encoded image, the decoded image, the OutputFormat of the full-size
+            result, the requested approach names (None for all of them) and the Selection
+            made for "auto".
+
+    Raises:
+        UploadError: If the image is missing or invalid, the approach is unknown or the
+            format is bad.
+    """
+    from imaging import choose_output_format, decode_image, image_size
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("image"), str):
+        raise UploadError("Expected a JSON body with a base64 data URL 'image'")
+    # Field types are checked before any decoding, with messages naming the field
+    preview = body.get("preview")
+    if preview is not None and (
+        not isinstance(preview, int) or isinstance(preview, bool) or preview <= 0
+    ):
+        raise UploadError("'preview' must be a positive integer size in pixels")
+    for field in ("approach", "format"):
+        if body.get(field) is not None and not isinstance(body[field], str):
+            raise UploadError(f"'{field}' must be a string")
+    try:
+        with instrumentation.stage("decode"):
+            data = base64.b64decode(body["image"].split(",")[-1])
+            image_array = decode_image(data, preview)
+
+        # Output format from the request body, defaulting to PNG or JPEG by image size
+        shape = image_array.shape if preview is None else image_size(data)
+        output_format = choose_output_format(shape, body.get("format"), body.get("quality"))
+        names, selection = choose_approaches(image_array, body.get("approach"))
+    except (TypeError, ValueError) as error:
+        raise UploadError(str(error))
+    return data, image_array, output_format, names, selection
+
+
+def read_preview(image_array):
+    """
+    Read the "preview" and "full_resolution" fields of a JSON request.
+
+    Returns:
+        Optional[tuple]: None without "preview", otherwise the shrunk image, its OutputFormat
+            and the full_resolution mode.
+
+    Raises:
+        UploadError: If the preview size or the full_resolution mode is invalid.
+    """
+    from approaches.stages import downscale
+    from imaging import choose_output_format
+
+    preview = request.json.get("preview")
+    if preview is None:
+        return None
+    full_resolution = request.json.get("full_resolution", "background")
+    try:
+        with instrumentation.stage("downscale"):
+            small = downscale(image_array, int(preview))
+        preview_format = choose_output_format(
+            small.shape, request.json.get("format"), request.json.get("quality")
+        )
+        if full_resolution not in FULL_RESOLUTION_MODES:
+            raise ValueError(f"Unknown full_resolution mode: {full_resolution}")
+    except (TypeError, ValueError) as error:
+        raise UploadError(str(error))
+    return small, preview_format, full_resolution
+
+
+def enhance_upload(data, output_format, names=None):
+    """Decode an upload at full resolution and enhance it, in a job after its request."""
+    from imaging import decode_image
+
+    return enhance(decode_image(data), output_format, names)
+
+
+def submit_full_resolution(data, output_format, names, full_resolution):
+    """
+    Queue the full-resolution follow-up of a preview request.
+
+    Returns:
+        Optional[dict]: The id, status and URL of the job, None for "full_resolution": "none".
+            When both the job queue and the deferred jobs are full, no job is created and
+            the status is "refused", with the error and the seconds to wait before retrying.
+    """
+    if full_resolution == "none":
+        return None
+    args = (enhance_upload, data, output_format, names)
+    try:
+        try:
+            job = jobs.submit(*args, deferred=full_resolution == "on_request")
+        except JobQueueFull:
+            # With the queue full the follow-up waits until it is fetched
+            job = jobs.submit(*args, deferred=True)
+    except JobQueueFull as error:
+        # The preview is still answered, without holding on to the upload
+        return {"status": "refused", "error": str(error), "retry_after": RETRY_AFTER}
+    return {"id": job.id, "status": job.status, "url": f"/filter-image/jobs/{job.id}"}
+
 
 @app.route("/filter-image", methods=["POST"])
 def filter_image():
-    data = request.json["image"]
-    base64_data = data.split(",")[1]
-    image_data = base64.b64decode(base64_data)
-    image = Image.open(io.BytesIO(image_data))
-    image_array = np.array(image)
-
-    # Convert images to bytes and then to base64
-    def convert_to_base64(image):
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode()
-
-    # Approach 1
-    approach1 = Approach1(image_array)
-    image_approach1 = approach1.process_image()
-    image1 = Image.fromarray(image_approach1)
-
-    # Approach 2
-    approach2 = Approach2(image_array)
-    image_approach2 = approach2.process_image()
-    image2 = Image.fromarray(image_approach2)
-
-    image_enhanced1 = convert_to_base64(image1)
-    image_enhanced2 = convert_to_base64(image2)
-
-    return jsonify(
-        {
-            "approach1": f"data:image/png;base64,{image_enhanced1}",
-            "approach2": f"data:image/png;base64,{image_enhanced2}",
-        }
+    """
+    Enhance a base64 data URL image with both approaches, or only the one named by
+    "approach". "approach": "auto" runs only the approach predicted to score best on a
+    no-reference quality metric and reports the decision under "selection".
+
+    With "preview": <max size> in the body, the approaches run on a copy shrunk to at most
+    that many pixels on its longer side and the response carries a job whose
+    full-resolution result is fetched from /filter-image/jobs/<id>. "full_resolution" picks
+    when that result is computed: "background" (default) starts right away, "on_request"
+    waits for the first fetch and "none" skips it.
+    """
+    data, image_array, output_format, names, selection = read_json_upload()
+    preview = read_preview(image_array)
+    if preview is None:
+        encoded = enhance(image_array, output_format, names)
+        return jsonify(enhanced_json(encoded, selection))
+
+    small, preview_format, full_resolution = preview
+    response = enhanced_json(enhance(small, preview_format, names), selection)
+    response["preview"] = {"width": small.shape[1], "height": small.shape[0]}
+    job = submit_full_resolution(data, output_format, names, full_resolution)
+    if job is not None:
+        response["job"] = job
+    return jsonify(response)
+
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/filter-image/stream", methods=["POST"])
+def filter_image_stream():
+    """
+    Streaming counterpart of /filter-image, taking the same JSON body. The response is a
+    text/event-stream: an "image" event carrying {name, image, encoding} is sent for each
+    approach as soon as it is encoded, so the first result arrives before the second one is
+    computed. "selection" (for "approach": "auto") and "job" (for previews) events carry
+    what /filter-image reports under those keys, and "done" ends the stream. A failure after
+    the stream started is reported as an "error" event.
+    """
+    data, image_array, output_format, names, selection = read_json_upload()
+    preview = read_preview(image_array)
+    source, source_format = (image_array, output_format) if preview is None else preview[:2]
+
+    def events():
+        try:
+            if selection is not None:
+                yield server_sent_event("selection", selection.report())
+            for name, encoded in enhance_iter(source, source_format, names):
+                yield server_sent_event(
+                    "image",
+                    {"name": name, "image": encoded.data_url(), "encoding": encoded.report()},
+                )
+            if preview is not None:
+                small, _, full_resolution = preview
+                job = submit_full_resolution(data, output_format, names, full_resolution)
+                yield server_sent_event(
+                    "job",
+                    {
+                        "preview": {"width": small.shape[1], "height": small.shape[0]},
+                        "job": job,
+                    },
+                )
+            yield server_sent_event("done", {})
+        except Exception as error:
+            app.logger.exception("Streaming enhancement failed")
+            yield server_sent_event("error", {"error": str(error)})
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
+@app.route("/filter-image/jobs/<job_id>", methods=["GET"])
+def filter_image_job(job_id):
+    """
+    Fetch the full-resolution result of a preview request. Jobs deferred until requested run
+    now; jobs still running in the background answer 202 with their status.
+    """
+    job = jobs.run(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    if job.status == "failed":
+        return jsonify({"id": job.id, "status": job.status, "error": job.error}), 500
+    if job.status != "done":
+        return jsonify({"id": job.id, "status": job.status}), 202
+    return jsonify({"id": job.id, "status": job.status, **enhanced_json(job.result)})
+
+
+def multipart_response(parts):
+    """
+    Build a multipart/mixed response holding one binary part per named image.
+
+    Args:
+        parts (dict): Maps part names to their EncodedImage.
+
+    Returns:
+        Response: The multipart response.
+    """
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for name, encoded in parts.items():
+        chunks.append(
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {encoded.format.mime_type}\r\n"
+                f'Content-Disposition: inline; name="{name}"; '
+                f'filename="{name}{encoded.format.extension}"\r\n'
+                f"Content-Length: {encoded.size}\r\n"
+                f"X-Encode-Time-Ms: {encoded.encode_ms:.2f}\r\n\r\n"
+            ).encode()
+        )
+        chunks.append(encoded.data)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return Response(b"".join(chunks), mimetype=f"multipart/mixed; boundary={boundary}")
+
+
+def read_binary_upload():
+    """
+    Read the image of a binary request: a multipart/form-data field named "image" or a raw
+    image/* body, plus the "approach", "format" and "quality" query parameters and the Accept
+    header. "approach=auto" selects the approach from the image.
+
+    Returns:
+        tuple: The decoded image, its OutputFormat, the requested approach names (None for
+            all of them) and the Selection made for "auto".
+
+    Raises:
+        UploadError: If the request holds no image, an unknown approach or a bad format.
+    """
+    from imaging import choose_output_format, decode_image
+
+    if "image" in request.files:
+        data = request.files["image"].read()
+    elif request.mimetype.startswith("image/"):
+        data = request.get_data(cache=False)
+    else:
+        raise UploadError("Expected a multipart 'image' field or an image/* body", 415)
+
+    approach = request.args.get("approach")
+    if approach not in (None, "auto") and approach not in pipeline.variants:
+        raise UploadError(f"Unknown approach: {approach}")
+    # A malformed quality is refused rather than replaced by the default
+    quality = request.args.get("quality")
+    if quality is not None:
+        try:
+            quality = int(quality)
+        except ValueError:
+            raise UploadError(f"The quality must be an integer, got {quality!r}")
+
+    try:
+        with instrumentation.stage("decode"):
+            image_array = decode_image(data)
+        output_format = choose_output_format(
+            image_array.shape,
+            request.args.get("format"),
+            quality,
+            [mime_type for mime_type, _ in request.accept_mimetypes],
+        )
+    except ValueError as error:
+        raise UploadError(str(error))
+    names, selection = choose_approaches(image_array, approach)
+    return image_array, output_format, names, selection
+
+
+def binary_response(encoded, selection=None):
+    """
+    Return a single enhanced image as is, or several as a multipart/mixed response.
+
+    Args:
+        encoded (dict): The EncodedImage of each approach.
+        selection (Optional[Selection]): The decision of an "auto" request, sent as JSON in
+            an X-Selection header.
+
+    Returns:
+        Response: The image or multipart response.
+    """
+    if len(encoded) != 1:
+        return multipart_response(encoded)
+    (image,) = encoded.values()
+    headers = {
+        "X-Encode-Time-Ms": f"{image.encode_ms:.2f}",
+        "X-Cache": "HIT" if image.cached else "MISS",
+    }
+    if selection is not None:
+        headers["X-Selection"] = json.dumps(selection.report(), separators=(",", ":"))
+    return Response(image.data, mimetype=image.format.mime_type, headers=headers)
+
+
+@app.route("/filter-image/binary", methods=["POST"])
+def filter_image_binary():
+    """
+    Binary counterpart of /filter-image. Accepts the image as a multipart/form-data field
+    named "image" or as a raw image/* body. Returns the variant named by the "approach" query
+    parameter as a single image, or both variants as a multipart/mixed response. The output
+    format comes from the "format"/"quality" query parameters or the Accept header.
+    """
+    image_array, output_format, names, selection = read_binary_upload()
+    return binary_response(enhance(image_array, output_format, names), selection)
+
+
+def job_json(job):
+    return {**job.report(), "url": f"/jobs/{job.id}", "result": f"/jobs/{job.id}/result"}
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Queue the enhancement of a binary upload (same inputs as /filter-image/binary) and
+    answer 202 at once with the job ID. Answers 429 while the job queue is full. With
+    "approach=auto" the approach is chosen before queueing and reported under "selection".
+    """
+    image_array, output_format, names, selection = read_binary_upload()
+    try:
+        job = jobs.submit(enhance, image_array, output_format, names)
+    except JobQueueFull as error:
+        return jsonify({"error": str(error)}), 429, {"Retry-After": str(RETRY_AFTER)}
+    response = job_json(job)
+    if selection is not None:
+        response["selection"] = selection.report()
+    return jsonify(response), 202, {"Location": f"/jobs/{job.id}"}
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(job_json(job))
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """
+    Return the images of a finished job like /filter-image/binary does. Answers 202 while
+    the job is queued or running and 500 if it failed.
+    """
+    job = jobs.run(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    if job.status == "failed":
+        return jsonify(job_json(job)), 500
+    if job.status != "done":
+        return jsonify(job_json(job)), 202
+    return binary_response(job.result)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Stage times of this server process in the Prometheus text format."""
+    if not instrumentation.ENABLED:
+        return jsonify({"error": "Metrics are disabled, set UNDERWATER_METRICS=1"}), 404
+    return Response(instrumentation.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    if cache is None:
+        return jsonify({"error": "The result cache is disabled"}), 404
+    return jsonify(cache.stats())
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness probe: 200 once OpenCV is loaded and the warm-up has run, 503 before. The body
+    carries the startup mode and timings in milliseconds: the module import, the image stack
+    import, the warm-up, the time to readiness and the first image request.
+    """
+    return jsonify(startup.report()), 200 if startup.ready else 503
+
+
+# Everything above only needs Flask; the image stack is loaded now, or in the background
+if startup.lazy:
+    threading.Thread(target=load_image_stack, name="image-stack", daemon=True).start()
+else:
+    load_image_stack()
+startup.record("import", startup.elapsed())
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,127 @@
+"""
+Memory-mapped image stacks.
+
+Survey cameras write 16-bit stacks much larger than memory. Headerless raw files, .npy files
+and uncompressed TIFFs are mapped with np.memmap instead of read, so the pipeline pages frames
+in strip by strip, and results are written into mapped output files the same way.
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+try:
+    import tifffile
+except ImportError:  # tifffile is optional, only TIFF stacks need it
+    tifffile = None
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+
+@dataclass(frozen=True)
+class RawLayout:
+    """
+    Layout of a headerless raw file: the shape of one frame (height, width[, channels]),
+    the sample type and the number of header bytes before the first frame.
+    """
+
+    shape: Tuple[int, ...]
+    dtype: str = "uint16"
+    offset: int = 0
+
+    def frames(self, path: str) -> int:
+        """
+        Count the frames of a raw file.
+
+        Args:
+            path (str): The raw file.
+
+        Returns:
+            int: The number of whole frames after the header.
+        """
+        frame_bytes = int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+        frames, rest = divmod(os.path.getsize(path) - self.offset, frame_bytes)
+        if frames < 1 or rest:
+            raise ValueError(f"{path} does not hold whole {self.dtype} {self.shape} frames")
+        return frames
+
+
+def _extension(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+
+def _require_tifffile() -> None:
+    if tifffile is None:
+        raise ValueError("Memory-mapping TIFF files requires the tifffile package")
+
+
+def as_stack(array: np.ndarray) -> np.ndarray:
+    """
+    View a single frame as a stack of one frame. Arrays of three dimensions are read as one
+    color frame when their last axis has 3 or 4 channels, and as grayscale frames otherwise.
+
+    Args:
+        array (np.ndarray): A frame or a stack of frames.
+
+    Returns:
+        np.ndarray: The stack, of shape (frames, height, width[, channels]).
+    """
+    if array.ndim == 2 or (array.ndim == 3 and array.shape[2] in (3, 4)):
+        return array[np.newaxis]
+    if array.ndim not in (3, 4):
+        raise ValueError(f"Cannot read an array of shape {array.shape} as image frames")
+    return array
+
+
+def open_stack(path: str, layout: Optional[RawLayout] = None) -> np.ndarray:
+    """
+    Map an image stack read-only. Nothing is read until frames are accessed.
+
+    Args:
+        path (str): A .npy file, an uncompressed TIFF or a headerless raw file.
+        layout (Optional[RawLayout]): The layout of a raw file, ignored for other files.
+
+    Returns:
+        np.ndarray: The mapped stack, of shape (frames, height, width[, channels]).
+    """
+    extension = _extension(path)
+    if extension == ".npy":
+        array = np.load(path, mmap_mode="r")
+    elif extension in TIFF_EXTENSIONS:
+        _require_tifffile()
+        try:
+            array = tifffile.memmap(path, mode="r")
+        except ValueError as error:
+            raise ValueError(
+                f"{path} is compressed or tiled and cannot be memory-mapped"
+            ) from error
+    else:
+        if layout is None:
+            raise ValueError(f"{path} is a raw file, its frame shape and dtype are needed")
+        shape = (layout.frames(path),) + tuple(layout.shape)
+        array = np.memmap(path, dtype=layout.dtype, mode="r", offset=layout.offset, shape=shape)
+    return as_stack(array)
+
+
+def create_stack(path: str, shape: Tuple[int, ...], dtype) -> np.ndarray:
+    """
+    Create a mapped output stack in the format given by the extension of `path`. Raw
+    outputs have no header.
+
+    Args:
+        path (str): The output file, overwritten if it exists.
+        shape (Tuple[int, ...]): The shape (frames, height, width[, channels]) of the stack.
+        dtype: The sample type.
+
+    Returns:
+        np.ndarray: The writable mapped stack. Call `flush` once it is written.
+    """
+    extension = _extension(path)
+    if extension == ".npy":
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    if extension in TIFF_EXTENSIONS:
+        _require_tifffile()
+        photometric = "rgb" if len(shape) == 4 and shape[3] == 3 else "minisblack"
+        return tifffile.memmap(path, shape=shape, dtype=dtype, photometric=photometric)
+    return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
@@ -0,0 +1,98 @@
+"""
+Cold-start timings and readiness of a server worker.
+
+Autoscaled workers pay for importing OpenCV, NumPy and PIL and for OpenCV's lazy
+initialization before they serve their first image. With UNDERWATER_STARTUP=lazy, main.py
+imports only Flask up front and loads the image stack in a background thread, so a new worker
+accepts connections right away and reports through /ready when it can serve. Either way, the
+time spent in each startup step and in the first request is recorded here.
+
+This module is imported first by main.py, so the import timing covers Flask as well.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+STARTUP_MODES = ("eager", "lazy")
+
+# When the server module started importing, the origin of every startup timing
+IMPORT_STARTED = time.perf_counter()
+
+
+class Startup:
+    """Timings of the cold start of a worker and whether it is ready to serve."""
+
+    def __init__(self, mode: str = "eager", started: float = IMPORT_STARTED) -> None:
+        """
+        Initialize the startup record
+
+        Args:
+            mode (str): "eager" loads the image stack while the server module is imported,
+                "lazy" after it, in the background.
+            started (float): The time.perf_counter() value the timings start from.
+        """
+        if mode not in STARTUP_MODES:
+            raise ValueError(f"Unknown startup mode: {mode}")
+        self.mode = mode
+        self.started = started
+        self.error: Optional[str] = None
+        self._timings: Dict[str, float] = {}
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Startup":
+        """Create the startup record of the mode in UNDERWATER_STARTUP (eager by default)."""
+        return cls(os.environ.get("UNDERWATER_STARTUP", "eager"))
+
+    @property
+    def lazy(self) -> bool:
+        return self.mode == "lazy"
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def record(self, name: str, milliseconds: float) -> None:
+        """
+        Record the duration of a startup step. Only the first value of a step is kept, so
+        "first_request" can be recorded after every request.
+
+        Args:
+            name (str): The step, such as "import" or "warm_up".
+            milliseconds (float): How long it took.
+        """
+        with self._lock:
+            self._timings.setdefault(name, round(milliseconds, 2))
+
+    def elapsed(self) -> float:
+        """Milliseconds since the server module started importing."""
+        return (time.perf_counter() - self.started) * 1000
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        """Record the duration of the enclosed block as the startup step `name`."""
+        start = time.perf_counter()
+        yield
+        self.record(name, (time.perf_counter() - start) * 1000)
+
+    def mark_ready(self) -> None:
+        """Record that the worker can serve images, and how long it took to get there."""
+        self.record("ready", self.elapsed())
+        self._ready.set()
+
+    def report(self) -> dict:
+        with self._lock:
+            timings = dict(self._timings)
+        report = {
+            "ready": self.ready,
+            "mode": self.mode,
+            "image_stack_loaded": "import_image_stack" in timings,
+            "warmed_up": "warm_up" in timings,
+            "timings_ms": timings,
+        }
+        if self.error is not None:
+            report["error"] = self.error
+        return report
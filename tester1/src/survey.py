@@ -0,0 +1,121 @@
+"""
+Enhance survey image stacks too large for memory.
+
+    python survey.py transect.tif --output enhanced
+    python survey.py transect.raw --shape 3000 4000 3 --dtype uint16 --output enhanced
+
+Inputs are memory-mapped (see rawio.py) and every frame runs strip by strip through the tiled
+pipeline, straight from the mapped input into one mapped output file per approach, so memory
+use depends on the strip size rather than the stack size. 8-bit, 16-bit and float32 samples
+are processed at their own depth, and outputs keep the format, dtype and color order of the
+input.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Dict, Optional, Sequence, TextIO
+
+import numpy as np
+
+from approaches.fusion import APPROACHES, FusionPipeline
+from rawio import TIFF_EXTENSIONS, RawLayout, create_stack, open_stack
+
+
+def output_path(source: str, output_dir: str, name: str) -> str:
+    stem, extension = os.path.splitext(os.path.basename(source))
+    return os.path.join(output_dir, f"{stem}.{name}{extension}")
+
+
+def enhance_stack(
+    stack: np.ndarray,
+    outputs: Dict[str, np.ndarray],
+    pipeline: FusionPipeline,
+    color_order: str = "bgr",
+    tile_rows: int = 512,
+    log: Optional[TextIO] = None,
+) -> None:
+    """
+    Enhance every frame of a stack into preallocated output stacks.
+
+    Args:
+        stack (np.ndarray): The input stack, of shape (frames, height, width[, channels]).
+        outputs (Dict[str, np.ndarray]): The output stack of each variant to run, of shape
+            (frames, height, width, 3) and the dtype of the input.
+        pipeline (FusionPipeline): The pipeline holding the variants.
+        color_order (str): The channel order of the input and output stacks, "bgr" or
+            "rgb". Frames are processed in their stored order.
+        tile_rows (int): The height of the strips in rows.
+        log (Optional[TextIO]): Receives a progress line per frame.
+    """
+    for index, frame in enumerate(stack):
+        targets = {name: output[index] for name, output in outputs.items()}
+        start = time.perf_counter()
+        pipeline.process_tiled(
+            frame, tile_rows, names=list(targets), outputs=targets, color_order=color_order
+        )
+        if log is not None:
+            elapsed = time.perf_counter() - start
+            print(f"frame {index + 1}/{len(stack)} in {elapsed:.1f}s", file=log)
+
+    for output in outputs.values():
+        if isinstance(output, np.memmap):
+            output.flush()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Enhance a memory-mapped image stack.")
+    parser.add_argument("source", help=".npy, uncompressed TIFF or headerless raw file")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument(
+        "-a",
+        "--approach",
+        action="append",
+        choices=sorted(APPROACHES),
+        help="approach to run, repeatable (default: all)",
+    )
+    parser.add_argument(
+        "--shape", type=int, nargs="+", help="raw files: frame height, width and channels"
+    )
+    parser.add_argument("--dtype", default="uint16", help="raw files: uint8, uint16 or float32")
+    parser.add_argument("--offset", type=int, default=0, help="raw files: header bytes")
+    parser.add_argument(
+        "--order",
+        choices=("bgr", "rgb"),
+        help="channel order (default: rgb for TIFF, bgr otherwise)",
+    )
+    parser.add_argument("--tile-rows", type=int, default=512, help="rows per strip")
+    args = parser.parse_args(argv)
+
+    layout = None
+    if args.shape:
+        if len(args.shape) not in (2, 3):
+            parser.error("--shape takes a height, a width and optionally channels")
+        layout = RawLayout(tuple(args.shape), args.dtype, args.offset)
+    try:
+        stack = open_stack(args.source, layout)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    if stack.dtype not in (np.uint8, np.uint16, np.float32):
+        parser.error(f"unsupported sample type {stack.dtype}")
+
+    order = args.order
+    if order is None:
+        is_tiff = os.path.splitext(args.source)[1].lower() in TIFF_EXTENSIONS
+        order = "rgb" if is_tiff else "bgr"
+    names = args.approach or list(APPROACHES)
+    pipeline = FusionPipeline({name: APPROACHES[name] for name in names})
+
+    os.makedirs(args.output, exist_ok=True)
+    shape = stack.shape[:3] + (3,)
+    outputs = {
+        name: create_stack(output_path(args.source, args.output, name), shape, stack.dtype)
+        for name in names
+    }
+    print(f"{len(stack)} frames of {stack.shape[1:]} {stack.dtype}", file=sys.stderr)
+    enhance_stack(stack, outputs, pipeline, order, args.tile_rows, sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
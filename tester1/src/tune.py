@@ -0,0 +1,93 @@
+"""
+Sweep the parameters of an approach on a representative image.
+
+    python tune.py reef.jpg --approach approach2 --clip-limit 1 2 3 --tile-grid 4 8 \\
+        --percentile 97 99 --weight-maps luminance luminance+saliency --size 512
+
+Every combination runs on one shared graph (see approaches/tuning.py), so intermediates that do
+not depend on a parameter are computed once, and is scored with a no-reference quality metric.
+The best combinations are printed, and the full report is written as JSON with --json.
+"""
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, Tuple
+
+from approaches.fusion import APPROACHES
+from approaches.quality import METRICS
+from approaches.tuning import sweep
+from imaging import decode_image
+
+
+def tile_grid(value: str) -> Tuple[int, int]:
+    """Parse a CLAHE tile grid given as "8" or "8x4"."""
+    rows, _, columns = value.partition("x")
+    try:
+        return int(rows), int(columns or rows)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid tile grid: {value}")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Score a grid of approach parameters.")
+    parser.add_argument("source", help="input image")
+    parser.add_argument(
+        "-a", "--approach", default="approach2", choices=sorted(APPROACHES), help="approach"
+    )
+    parser.add_argument("--clip-limit", type=float, nargs="+", help="CLAHE clip limits")
+    parser.add_argument("--tile-grid", type=tile_grid, nargs="+", help="CLAHE grids, e.g. 8x8")
+    parser.add_argument("--percentile", type=float, nargs="+", help="white balance percentiles")
+    parser.add_argument(
+        "--weight-maps", nargs="+", help="fusion weight maps, e.g. luminance+saliency"
+    )
+    parser.add_argument("--fusion", nargs="+", choices=("weighted", "pyramid"), help="fusion")
+    parser.add_argument("-m", "--metric", default="uciqe", choices=sorted(METRICS))
+    parser.add_argument("--size", type=int, help="sweep on a thumbnail of this longer side")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="trials in parallel")
+    parser.add_argument("--top", type=int, default=10, help="combinations printed")
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args(argv)
+
+    grid = {
+        name: values
+        for name, values in (
+            ("clip_limit", args.clip_limit),
+            ("tile_grid", args.tile_grid),
+            ("percentile", args.percentile),
+            ("weight_maps", [kinds.split("+") for kinds in args.weight_maps or []] or None),
+            ("fusion", args.fusion),
+        )
+        if values
+    }
+    try:
+        with open(args.source, "rb") as source:
+            image = decode_image(source.read())
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            result = sweep(
+                image,
+                APPROACHES[args.approach],
+                grid,
+                args.metric,
+                executor if args.workers > 1 else None,
+                args.size,
+            )
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    width, height = result.size
+    print(
+        f"{len(result.trials)} combinations on {width}x{height} in "
+        f"{result.elapsed_ms / 1000:.1f}s, {args.metric}:",
+        file=sys.stderr,
+    )
+    for trial in result.trials[: args.top]:
+        print(f"{trial.score:.4f}  {trial.name or args.approach}")
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(result.report(), output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+"""
+Production entry point. Serve the app from several worker processes with:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from main import app
+
+__all__ = ["app"]